@@ -1,26 +1,39 @@
 import serial
 import time
-import threading
-import struct
-from collections import deque
+import os
 import sys
 
-from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AcousticSensor"))
+from bsdecode import BlockDecoder
+from ring import BlockRing, BLOCK, DROP_OLDEST, DROP_NEWEST
+from pipeline import Pipeline
+from streamparser import StreamParser
+from capturefile import CaptureWriter
+from linkcal import BAUD_RATES, calibrate, checkRate, linkByteRate, maxSampleRate, measureByteRate
 
 """ User Parameters """
 sampleRate = 100000 # hz per channel
 channels = 1 # 1 is ch A alone, 2 is both
 macro = True # 12 bit or not
 fileName = "data"
+captureBlocks = 10 # blocks written to the capture file, None for all of them
+ringSlots = 32 # serial blocks buffered between the reader and the decoder
+overflowPolicy = DROP_OLDEST # BLOCK, DROP_OLDEST or DROP_NEWEST when the ring is full
+calibrateLink = False # measure the link at each of baudRates at startup and keep the fastest
+baudRates = BAUD_RATES
+rateCheck = "warn" # "warn", "refuse" or "fit" (lower sampleRate) when the link can't carry sampleRate
 
 """ Internal """
-running = True
 ser = serial.Serial("/dev/ttyUSB0", 115200, timeout=1.0)
 serWaiting = 0
-dataQueue = deque()
+blockSize = 20000 # bytes per serial read
+dataRing = BlockRing(ringSlots, blockSize, overflowPolicy)
 frameToken = "af"
+frameSize = None # bytes from one frame token to the next, None learns it from the stream
+calibrationRate = 1000000 # sample clock while calibrating, faster than any link
+calibrationTime = 2.0 # seconds measured per baud
 tickRate = 0
-filePath = "./" + fileName + ".txt"
+filePath = "./" + fileName + ".cap" # see capturefile.py
 readCount = 600
 
 if channels == 1:
@@ -54,28 +67,14 @@ def clearWaiting():
 
 """ Utilities """
 def freqToHexTicks(freq):
-    ticks = int((freq ** -1) / 0.000000025)
+    """ (low, high) register bytes in hex of the 40 MHz clock ticks per sample. """
+    ticks = int(round((freq ** -1) / 0.000000025))
     print(ticks)
-    hexTicks = hex(ticks)[2:]
-    zeroAdds = "0" * (4 % len(hexTicks))
-    combined = zeroAdds + hexTicks
+    if not 0 < ticks <= 0xffff:
+        raise ValueError("%d Hz is %d clock ticks, outside the 16 bit tick register" % (freq, ticks))
+    combined = "%04x" % ticks
     return combined[2:], combined[:2]
     
-def getToRange(fromRange, toRange):
-    fr, tr = fromRange, toRange
-    slope = float(tr[1] - tr[0]) / float(fr[1] - fr[0])
-    return lambda v : round((10**6) * (tr[0] + slope * float(v - fr[0])), 1)
-    
-""" Decoding """
-def decode1ChMacro(data):
-    unpackArg = "<" + str(int(len(data) / 2)) + "h"
-    unpacked = list(struct.unpack(unpackArg, data))
-    for i in unpacked:
-        a = (i & 0x00ff) >> 4
-        b = (i & 0xff00) << 4
-        i = a + b
-    return unpacked
-
 def setupBS():
     """ Standard setup procedure. """
     if channels == 1:
@@ -100,81 +99,87 @@ def setupBS():
     readAll()
     
 def startStream():
-    read(2) # ?!?!?!
+    # Whatever precedes the first frame is skipped by the parser
     issueWait("T")
     
-def readLoop():
+def measureLink():
+    """ Sample bytes/s the link carries with the device streaming flat out. """
+    global tickRate
+    configured, tickRate = tickRate, calibrationRate
+    try:
+        setupBS()
+        startStream()
+        return measureByteRate(StreamParser(ser, bytearray.fromhex(frameToken), frameSize), calibrationTime)
+    finally:
+        tickRate = configured
+        issueWait(".")
+        readAll()
+    
+def fitSampleRate(linkRate):
+    """ Check sampleRate against the link's bytes/s as rateCheck says. """
+    global sampleRate, tickRate
+    best = checkRate(sampleRate, linkRate, macro, channels, frameSize, strict = rateCheck == "refuse")
+    if rateCheck == "fit" and sampleRate > best:
+        sampleRate = best
+        tickRate = sampleRate * 2 if macro else sampleRate
+        print ("Sample rate lowered to %d Hz" % sampleRate)
+    
+def reportResync(offset, skipped):
+    print ("Stream resync at byte %d, %d bytes skipped" % (offset, skipped))
+    
+def readSetup():
+    """ Runs in the reader thread before its first read. """
     setupBS()
     startStream()
-    while running:
-        data = bytearray()
-        toGet = 20000                   # Take 44000 samples in 1 second
-        data = ser.read(toGet)
-        dataQueue.append(data)
         
-def writeToFile(file, data, count):
-    # Write to file
-    dataStr = ','.join(map(str, data))
-    #for i in range(len(data)/100):
-     #   print data[i]
-    # toWrite = dataStr + ',' + str(datetime.now()) + '\n'
-    toWrite = str(datetime.now()) + '\n'
-    file.write(toWrite)
-    
-def processAndWriteLoop():
-    decodeFn = None
-    if channels == 1:
-        if not macro:
-            decodeFn = decode1Ch
-        else:
-            decodeFn = decode1ChMacro
-
-    fromRange = None
-    if macro:
-        fromRange = (-32768, 32767)
-    else:
-        fromRange = (0, 255)
-
-    toRangeLambda = getToRange(fromRange, (-5, 5))
-    dumpFile = open(filePath, 'w')
+def processAndWriteLoop(pipeline):
+    decoder = BlockDecoder(macro, (-5, 5))
+    scale, offset = decoder.levelScale()
+    capture = CaptureWriter(filePath)
 
     counter = 0
-    while True:
-        #time.sleep(0.1)
-        while len(dataQueue):
-            # Pop data
-            data = dataQueue.popleft()
-            # Decode
-            levelData = decodeFn(data)
-            # Voltify
-            voltData = list(map(toRangeLambda, levelData))
-            # Write
-            #if (counter == 0):
-                #print("start: " + str(datetime.now()))
-            #if (counter == 1) :
-                #print("Finish 10 SAMPLES" + str(datetime.now()))
-            if (counter < 10) :
-                writeToFile(dumpFile, voltData, counter)
-            #if (counter == 1) :
-                #print("Finish 10 SAMPLES" + str(datetime.now()))
-                #print("start: " + str(datetime.now()))
+    try:
+        # Sleeps until the reader hands over a block
+        for data in pipeline:
+            # Decode, levels are written as they are with the scale to volts
+            levelData = decoder.decode(data)
+            if captureBlocks is None or counter < captureBlocks:
+                capture.append(levelData, time.time(), sampleRate, scale, offset)
             counter = counter + 1
-            #time.sleep(5)
+    finally:
+        capture.close()
     
 def main():
+    # Stop BS and clear out serial buffer
+    issueWait(".")
+    readAll()
+    linkRate = linkByteRate(ser.baudrate)
+    if calibrateLink:
+        baud, linkRate, measured = calibrate(ser, measureLink, baudRates)
+        for each in sorted(measured):
+            print ("Link: %d baud carries %.0f bytes/s" % (each, measured[each]))
+        print ("Link: using %d baud, up to %d Hz" % (baud, maxSampleRate(linkRate, macro, channels, frameSize)))
+    try:
+        fitSampleRate(linkRate)
+    except ValueError as e:
+        print ("Not starting: %s" % e)
+        sys.exit(1)
+    streamParser = StreamParser(ser, bytearray.fromhex(frameToken), frameSize, onResync = reportResync)
+    pipeline = Pipeline(dataRing, streamParser.readinto, readSetup)
     try :
-        # Stop BS and clear out serial buffer
-        issueWait(".")
-        readAll()
         # Open read stream thread
-        readThread = threading.Thread(target = readLoop)
-        readThread.start()
+        pipeline.start()
         # Start writing loop in main thread
-        processAndWriteLoop()
+        processAndWriteLoop(pipeline)
     
     except (KeyboardInterrupt, Exception) as e:
         print (e)
-        print ("Program terminated successfully")
+    # Stop the reader after its current read
+    pipeline.stop(2 * ser.timeout)
+    print ("Stream: %d frames, %d resyncs, %d bytes skipped" % (
+        streamParser.frames, len(streamParser.resyncs), streamParser.skipped))
+    print ("Ring: %(produced)d blocks read, %(dropped)d dropped, high water %(highWater)d of %(slots)d" % dataRing.stats())
+    print ("Program terminated successfully")
         
 if __name__ == '__main__':
     sys.exit(main())
@@ -16,5 +16,9 @@ if [ ! -d ./aws-iot-device-sdk-python ]; then
   popd
 fi
 
-# run pub/sub sample app using certificates downloaded in package
-python myAcousticSensor.py -e a26l68lei3sfjz.iot.us-east-2.amazonaws.com -r root-CA.crt -c 0db9811d7e-certificate.pem.crt -k 0db9811d7e-private.pem.key
+# run pub/sub sample app, publishing through the shared uplink daemon. It
+# connects as the dummyTempSensor thing, not with the 0db9811d7e
+# certificate here: see ../uplinkStart.sh for the policy it needs and how
+# to pick the identity
+../uplinkStart.sh
+python myAcousticSensor.py -u /tmp/uplink.sock
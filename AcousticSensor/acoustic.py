@@ -16,7 +16,6 @@
  '''
 import plotly.plotly as py
 from plotly.graph_objs import *
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 from bitlib import *
 
 import logging
@@ -29,6 +28,13 @@ import time
 import sys
 import signal
 import RPi.GPIO as GPIO
+from capture import DoubleBufferedCapture, SequentialCapture, StreamCapture
+from frames import encodeVolts
+from windowstats import encodeSummary, windowStats
+from capturefile import CaptureWriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from uplink import SOCKET_PATH, UplinkClient
 
 
 # Folder directory definitions
@@ -38,6 +44,13 @@ MY_PROBE_FILE = "" # default probe file if unspecified
 MY_MODE = BL_MODE_FAST # preferred capture mode
 MY_RATE = 1000000 # default sample rate we'll use for capture.
 MY_SIZE = 10000 # number of samples we'll capture (simply a connectivity test)
+MY_DOUBLE_BUFFER = True # trace the next capture while the last one is published
+MY_STREAM = False # gapless STREAM mode capture instead of triggered traces
+MY_STREAM_RATE = 100000 # sample rate for STREAM mode
+MY_BINARY = True # binary frames (see frames.py) rather than CSV text
+MY_STATS_WINDOW = 1000 # samples per window of the statistics published on /AcousticSensor/stats
+MY_PUBLISH_RAW = False # publish the samples themselves on /AcousticSensor as well
+MY_CAPTURE_FILE = "" # capture file (see capturefile.py) every trace is appended to, "" for none
 TRUE = 1
 
 MODES = ("FAST","DUAL","MIXED","LOGIC","STREAM")
@@ -56,74 +69,14 @@ GPIO.setwarnings(False)
 
 ####################################################
 
-# Custom MQTT message callback
-def customCallback(client, userdata, message):
-    print("Received a new message: ")
-    print(message.payload)
-    print("from topic: ")
-    print(message.topic)
-    print("--------------\n\n")
-
-
 # Read in command-line parameters
 parser = argparse.ArgumentParser()
-parser.add_argument("-e", "--endpoint", action="store", required=True, dest="host", help="Your AWS IoT custom endpoint")
-parser.add_argument("-r", "--rootCA", action="store", required=True, dest="rootCAPath", help="Root CA file path")
-parser.add_argument("-c", "--cert", action="store", dest="certificatePath", help="Certificate file path")
-parser.add_argument("-k", "--key", action="store", dest="privateKeyPath", help="Private key file path")
-parser.add_argument("-w", "--websocket", action="store_true", dest="useWebsocket", default=False,
-                    help="Use MQTT over WebSocket")
-parser.add_argument("-id", "--clientId", action="store", dest="clientId", default="basicPubSub",
-                    help="Targeted client id")
-parser.add_argument("-t", "--topic", action="store", dest="topic", default="sdk/test/Python", help="Targeted topic")
-
+parser.add_argument("-u", "--uplink", action="store", dest="uplinkPath", default=SOCKET_PATH,
+                    help="Socket of the uplink daemon (uplink.py) that owns the AWS IoT connection")
 args = parser.parse_args()
-host = args.host
-rootCAPath = args.rootCAPath
-certificatePath = args.certificatePath
-privateKeyPath = args.privateKeyPath
-useWebsocket = args.useWebsocket
-clientId = args.clientId
-topic = args.topic
-
-if args.useWebsocket and args.certificatePath and args.privateKeyPath:
-    parser.error("X.509 cert authentication and WebSocket are mutual exclusive. Please pick one.")
-    exit(2)
-
-if not args.useWebsocket and (not args.certificatePath or not args.privateKeyPath):
-    parser.error("Missing credentials for authentication.")
-    exit(2)
-
-# Configure logging
-logger = logging.getLogger("AWSIoTPythonSDK.core")
-logger.setLevel(logging.DEBUG)
-streamHandler = logging.StreamHandler()
-#formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-#streamHandler.setFormatter(formatter)
-#logger.addHandler(streamHandler)
-
-# Init AWSIoTMQTTClient
-myAWSIoTMQTTClient = None
-if useWebsocket:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId, useWebsocket=True)
-    myAWSIoTMQTTClient.configureEndpoint(host, 443)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath)
-else:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-    myAWSIoTMQTTClient.configureEndpoint(host, 8883)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
-
-# AWSIoTMQTTClient connection configuration
-myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
-myAWSIoTMQTTClient.configureDrainingFrequency(10)  # Draining: 2 Hz
-myAWSIoTMQTTClient.configureConnectDisconnectTimeout(300)  # 5 mins
-myAWSIoTMQTTClient.configureMQTTOperationTimeout(120)  # 2 mins
-
-# Connect and subscribe to AWS IoT
-myAWSIoTMQTTClient.connect()
-myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
-time.sleep(2)
+
+# Publish through the uplink daemon, which also spools while offline
+uplink = UplinkClient(args.uplinkPath)
 
 #TIME_STAMP = np.rand(100000)
 #for i in range(25000):
@@ -196,27 +149,57 @@ def main():
             BL_Offset(BL_ZERO); # optional, default 0
             BL_Enable(TRUE); # at least one channel must be initialised
 
-        
-            while True:
-                #
-                # Perform an (untriggered) trace (this is the actual data capture).
-                #
-                BL_Trace()
-                #
-                # Acquire (i.e. upload) the captured data (which may be less than MY_SIZE!).
-                #
-                DATA = BL_Acquire()
-                ## Publish on MQTT Client
-                messageObject = (",".join(["%5.8f" % DATA[n] for n in range(len(DATA))]))
-                #myAWSIoTMQTTClient.publish("/AcousticSensor", messageObject, 1)
-                #print (" Data(%d): " % MY_SIZE + ", ".join(["%f" % DATA[n] for n in range(len(DATA))]))
-                print(messageObject)
-                time.sleep(0)
+            #
+            # Perform (untriggered) traces and acquire (i.e. upload) the captured data
+            # (which may be less than MY_SIZE!) into preallocated buffers. Double
+            # buffered, the next trace runs while this one is published. In STREAM
+            # mode the device never stops and MY_SIZE samples are handed over at a time.
+            #
+            if MY_STREAM:
+                captures = StreamCapture(MY_SIZE, MY_STREAM_RATE)
+            elif MY_DOUBLE_BUFFER:
+                captures = DoubleBufferedCapture(MY_SIZE)
+            else:
+                captures = SequentialCapture(MY_SIZE)
+            capture = CaptureWriter(MY_CAPTURE_FILE, MY_CHANNEL) if MY_CAPTURE_FILE else None
+            captures.start()
+            try:
+                for frame, DATA in enumerate(captures):
+                    if capture is not None:
+                        capture.appendVolts(DATA, time.time(), captures.rate)
+                    ## Publish on MQTT Client
+                    stats = windowStats(DATA, MY_STATS_WINDOW, captures.rate, time.time())
+                    summary = encodeSummary(stats, captures.rate, MY_STATS_WINDOW, MY_CHANNEL, frame)
+                    print ("   Frame: %d, RMS %.4f V, peak to peak %.4f V" % (
+                        frame, stats["rms"].max(), stats["p2p"].max()))
+                    uplink.publish("/AcousticSensor/stats", summary)
+                    if not MY_PUBLISH_RAW:
+                        continue
+                    if MY_BINARY:
+                        messageObject = encodeVolts(DATA, captures.rate, MY_CHANNEL, frame)
+                        print ("   Frame: %d, %d samples in %d bytes" % (
+                            frame, len(DATA), len(messageObject)))
+                    else:
+                        messageObject = (",".join(["%5.8f" % DATA[n] for n in range(len(DATA))]))
+                        print(messageObject)
+                    #uplink.publish("/AcousticSensor", messageObject)
+                    #print (" Data(%d): " % MY_SIZE + ", ".join(["%f" % DATA[n] for n in range(len(DATA))]))
+            finally:
+                captures.stop()
+                if capture is not None:
+                    capture.close()
+                print ("Captures: %d, device duty cycle %.0f%%" % (
+                    captures.traces, 100 * captures.dutyCycle()))
+                if MY_STREAM:
+                    print ("  Stream: %d samples, %d lost to overrun, %d short, %d restarts" % (
+                        captures.ring.head, captures.lost,
+                        captures.shortfall(), captures.restarts))
                 
             # Close the library to release resources (we're done).
             #
             BL_Close()
             print ("Finished: Library closed, resources released.")
+            uplink.close()
         else:
             print ("  FAILED: device not found (check your probe file).")
             
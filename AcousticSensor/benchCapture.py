@@ -0,0 +1,68 @@
+""" Capture file against the text dump it replaces.
+
+Writes the same blocks as comma joined microvolt text (as DataLogger
+holds) and as a capture file, then reads a 1 second slice from the
+middle of each. The text has to be parsed from the top to find it.
+
+Run on the Pi with: python benchCapture.py [blocks] """
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bsdecode import BlockDecoder
+from capturefile import CaptureReader, CaptureWriter
+
+BLOCK = 20000 # bytes per serial read, as in readLoop
+SAMPLE_RATE = 20000
+
+
+def writeText(path, decoder, blocks):
+    with open(path, "w") as f:
+        for data in blocks:
+            f.write(",".join("%.1f" % v for v in (decoder.voltify(data) * 10 ** 6)) + ",\n")
+
+def readText(path, start, end):
+    with open(path) as f:
+        volts = np.concatenate([np.array(line.rstrip(",\n").split(","), dtype=np.float64) for line in f])
+    return volts[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)] / 10 ** 6
+
+def writeCapture(path, decoder, blocks):
+    scale, offset = decoder.levelScale()
+    capture = CaptureWriter(path)
+    for i, data in enumerate(blocks):
+        capture.append(decoder.decode(data), i * (BLOCK // 2) / float(SAMPLE_RATE), SAMPLE_RATE, scale, offset)
+    capture.close()
+
+def readCapture(path, start, end):
+    reader = CaptureReader(path)
+    times, volts = reader.read(start, end)
+    reader.close()
+    return volts
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return time.time() - start, result
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    rng = np.random.RandomState(0)
+    blocks = [rng.randint(0, 256, BLOCK).astype(np.uint8).tobytes() for _ in range(count)]
+    decoder = BlockDecoder(True, (-5, 5))
+    seconds = count * (BLOCK // 2) / float(SAMPLE_RATE)
+    start, end = seconds / 2, seconds / 2 + 1
+    folder = tempfile.mkdtemp()
+    for name, write, read, path in (("text", writeText, readText, os.path.join(folder, "data.txt")),
+                                    ("capture", writeCapture, readCapture, os.path.join(folder, "data.cap"))):
+        writeTime = timed(write, path, decoder, blocks)[0]
+        readTime, volts = timed(read, path, start, end)
+        print("%8s: %9d bytes, write %8.1f ms, 1 s slice read %8.2f ms (%d samples)" % (
+            name, os.path.getsize(path), 1000 * writeTime, 1000 * readTime, len(volts)))
+        os.remove(path)
+    os.rmdir(folder)
+
+if __name__ == '__main__':
+    sys.exit(main())
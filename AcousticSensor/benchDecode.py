@@ -0,0 +1,58 @@
+""" Decode + voltify throughput, per sample path against block path.
+
+Run on the Pi with: python benchDecode.py [blocks] """
+import struct
+import sys
+import time
+
+import numpy as np
+
+from bsdecode import BlockDecoder
+
+BLOCK = 20000 # bytes per serial read, as in readLoop
+
+
+""" Per sample path as it was in the scripts """
+def getToRange(fromRange, toRange):
+    fr, tr = fromRange, toRange
+    slope = float(tr[1] - tr[0]) / float(fr[1] - fr[0])
+    return lambda v : round((10**6) * (tr[0] + slope * float(v - fr[0])), 1)
+
+def decode1ChMacro(data):
+    unpackArg = "<" + str(int(len(data) / 2)) + "h"
+    unpacked = list(struct.unpack(unpackArg, data))
+    for i in unpacked:
+        a = (i & 0x00ff) >> 4
+        b = (i & 0xff00) << 4
+        i = a + b
+    return unpacked
+
+def legacy(blocks):
+    toRangeLambda = getToRange((-32768, 32767), (-5, 5))
+    for data in blocks:
+        list(map(toRangeLambda, decode1ChMacro(data)))
+
+def batched(blocks):
+    decoder = BlockDecoder(True, (-5, 5))
+    out = np.empty(BLOCK // 2)
+    for data in blocks:
+        decoder.voltify(data, out)
+
+def rate(fn, blocks):
+    start = time.time()
+    fn(blocks)
+    elapsed = time.time() - start
+    return len(blocks) * (BLOCK // 2) / elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = np.random.RandomState(0)
+    blocks = [rng.randint(0, 256, BLOCK).astype(np.uint8).tobytes() for _ in range(count)]
+    old = rate(legacy, blocks)
+    new = rate(batched, blocks)
+    print("per sample: %12.0f samples/s" % old)
+    print("   batched: %12.0f samples/s" % new)
+    print("   speedup: %12.1fx" % (new / old))
+
+if __name__ == '__main__':
+    sys.exit(main())
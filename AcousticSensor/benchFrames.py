@@ -0,0 +1,48 @@
+""" Payload size and encode time, CSV text against binary frames.
+
+Run with: python benchFrames.py [blocks] """
+import sys
+import time
+
+import numpy as np
+
+from bsdecode import BlockDecoder
+from frames import decodeFrame, encodeFrame, encodeVolts, toVolts
+
+BLOCK = 20000 # bytes per serial read
+
+
+def measure(name, encode, items):
+    start = time.time()
+    sizes = [len(encode(item)) for item in items]
+    elapsed = time.time() - start
+    samples = sum(len(item) for item in items)
+    print("%-22s %6.2f bytes/sample %12.0f samples/s" % (
+        name, float(sum(sizes)) / samples, samples / elapsed))
+    return elapsed, sum(sizes)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = np.random.RandomState(0)
+    blocks = [rng.randint(0, 256, BLOCK).astype(np.uint8).tobytes() for _ in range(count)]
+    decoder = BlockDecoder(True, (-5, 5))
+    scale, offset = decoder.levelScale()
+
+    # myAcousticSensor.py: voltified microvolts joined as text
+    volts = [decoder.voltify(b) for b in blocks]
+    csvTime, csvSize = measure("csv (serial)", lambda v: ','.join(map(str, v.tolist())) + ',\n', volts)
+    levels = [decoder.decode(b) for b in blocks]
+    binTime, binSize = measure("binary (serial)", lambda l: encodeFrame(l, scale, offset, 20000), levels)
+    print("%-22s %6.1fx smaller %6.1fx faster" % ("", float(csvSize) / binSize, csvTime / binTime))
+
+    # acoustic.py: bitlib float volts
+    traces = [v / 1e6 for v in volts]
+    csvTime, csvSize = measure("csv (bitlib)", lambda d: ",".join(["%5.8f" % d[n] for n in range(len(d))]), traces)
+    binTime, binSize = measure("binary (bitlib)", lambda d: encodeVolts(d, 1e6), traces)
+    print("%-22s %6.1fx smaller %6.1fx faster" % ("", float(csvSize) / binSize, csvTime / binTime))
+
+    header, samples = decodeFrame(encodeVolts(traces[0], 1e6))
+    print("round trip max error: %.3g V" % np.abs(toVolts(header, samples) - traces[0]).max())
+
+if __name__ == '__main__':
+    sys.exit(main())
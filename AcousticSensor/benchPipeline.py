@@ -0,0 +1,75 @@
+""" Serial reader throughput with a spinning consumer and with a blocking one.
+
+The reader is a stand-in for pyserial that copies a block in small
+chunks with some Python work per chunk, as Serial.read does. Both
+consumers decode every block; only the way they wait differs.
+
+Run with: python benchPipeline.py [seconds] """
+import sys
+import time
+
+from bsdecode import BlockDecoder
+from pipeline import Pipeline
+from ring import BlockRing, BLOCK
+
+BLOCK_SIZE = 20000
+CHUNK = 256
+
+
+class FakeSerial(object):
+    """ With a rate the link is limited to that many bytes/s, waiting like a real port. """
+
+    def __init__(self, rate=None):
+        self.source = bytes(bytearray(BLOCK_SIZE))
+        self.rate = rate
+
+    def readinto(self, view):
+        n = len(view)
+        for pos in range(0, n, CHUNK):
+            view[pos:pos + CHUNK] = self.source[pos:pos + CHUNK]
+            if self.rate:
+                time.sleep(CHUNK / float(self.rate))
+        return n
+
+
+def spinning(pipeline, decoder, seconds):
+    """ The old loop: poll the queue length with no sleep. """
+    ring = pipeline.ring
+    end = time.time() + seconds
+    while time.time() < end:
+        while len(ring):
+            slot, data = ring.get()
+            decoder.voltify(data)
+            ring.release(slot)
+
+def blocking(pipeline, decoder, seconds):
+    end = time.time() + seconds
+    for data in pipeline:
+        decoder.voltify(data)
+        if time.time() >= end:
+            break
+
+def measure(consume, seconds, link=None):
+    ring = BlockRing(8, BLOCK_SIZE, BLOCK)
+    pipeline = Pipeline(ring, FakeSerial(link).readinto)
+    decoder = BlockDecoder(True)
+    cpu = time.process_time()
+    pipeline.start()
+    consume(pipeline, decoder, seconds)
+    pipeline.stop()
+    cpu = time.process_time() - cpu
+    rate = ring.stats()["produced"] * BLOCK_SIZE / float(seconds)
+    print("%-9s reader %10.0f bytes/s, process CPU %3.0f%%" % (
+        consume.__name__, rate, 100 * cpu / seconds))
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("Unthrottled reader (GIL contention):")
+    measure(spinning, seconds)
+    measure(blocking, seconds)
+    print("Reader limited to a 115200 baud link (idle cost):")
+    measure(spinning, seconds, 11520)
+    measure(blocking, seconds, 11520)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+""" Block throughput of the shared memory pipeline against worker count.
+
+The reader hands over prefilled blocks as fast as it can; each worker
+decodes a block and formats it as CSV text, the heaviest per block work
+in myAcousticSensor.py. On a four core Pi throughput should rise with
+the number of workers until the reader or the cores run out.
+
+Run with: python benchProcesses.py [seconds] """
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from bsdecode import BlockDecoder
+from shmpipeline import ProcessPipeline
+from ring import BLOCK
+
+BLOCK_SIZE = 20000
+
+decoder = BlockDecoder(True)
+source = np.random.RandomState(0).randint(0, 256, BLOCK_SIZE).astype(np.uint8).tobytes()
+
+
+def read(view):
+    view[:] = source
+    return len(view)
+
+def handle(data, seq, startTime):
+    return len(','.join(map(str, decoder.voltify(data).tolist())))
+
+def measure(workers, seconds):
+    pipeline = ProcessPipeline(8, BLOCK_SIZE, read, handle, workers, policy=BLOCK)
+    pipeline.start()
+    done = 0
+    end = time.time() + seconds
+    for seq, result in pipeline:
+        done += 1
+        if time.time() >= end:
+            break
+    pipeline.stop(5)
+    print("%d workers: %7.1f blocks/s" % (workers, done / float(seconds)))
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for workers in range(1, multiprocessing.cpu_count() + 1):
+        measure(workers, seconds)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+""" Spectrogram throughput against the sample rate it has to keep up with.
+
+Each 20000 byte block is decoded and fed to Spectrogram, once with the
+frames of a block taken in one batched rfft and once frame by frame in a
+Python loop. Real time at sampleRate needs more than sampleRate samples/s.
+
+Run on the Pi with: python benchSpectrum.py [blocks] [sampleRate] """
+import sys
+import time
+
+import numpy as np
+
+from bsdecode import BlockDecoder
+from spectrum import Spectrogram
+
+BLOCK = 20000 # bytes per serial read, as in readLoop
+
+
+def perFrame(spectrogram, volts):
+    """ The same spectra one frame at a time, without the carry. """
+    nfft, hop = spectrogram.nfft, spectrogram.hop
+    for start in range(0, len(volts) - nfft + 1, hop):
+        power = np.abs(np.fft.rfft(volts[start:start + nfft] * spectrogram.window)) ** 2 * spectrogram.norm
+        [power[a:b].sum() for a, b in zip(spectrogram.bandStarts, list(spectrogram.bandStarts[1:]) + [len(power)])]
+        spectrogram.freqs[1 + np.argmax(power[1:])]
+
+def batched(spectrogram, volts):
+    spectrogram.update(volts)
+
+def rate(fn, blocks, sampleRate):
+    decoder = BlockDecoder(True, (-5, 5))
+    spectrogram = Spectrogram(sampleRate)
+    out = np.empty(BLOCK // 2)
+    start = time.time()
+    for data in blocks:
+        fn(spectrogram, decoder.voltify(data, out))
+    elapsed = time.time() - start
+    return len(blocks) * (BLOCK // 2) / elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    sampleRate = float(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rng = np.random.RandomState(0)
+    blocks = [rng.randint(0, 256, BLOCK).astype(np.uint8).tobytes() for _ in range(count)]
+    old = rate(perFrame, blocks, sampleRate)
+    new = rate(batched, blocks, sampleRate)
+    print("  per frame: %12.0f samples/s, %6.1fx real time" % (old, old / sampleRate))
+    print("    batched: %12.0f samples/s, %6.1fx real time" % (new, new / sampleRate))
+    print("    speedup: %12.1fx" % (new / old))
+
+if __name__ == '__main__':
+    sys.exit(main())
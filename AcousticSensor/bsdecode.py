@@ -0,0 +1,74 @@
+""" Block decoding for the BitScope serial stream.
+
+Whole blocks read from the serial link are decoded and voltified as
+typed arrays. Every raw sample code maps to exactly one output voltage,
+so the decode, the 12 bit repack and the voltage conversion are folded
+into a single lookup table and applied to a block in one pass. """
+import numpy as np
+
+MACRO_RANGE = (-2048, 2047) # 12 bit macro levels after repacking
+BYTE_RANGE = (0, 255) # 8 bit levels
+VOLT_RANGE = (-5, 5)
+SCALE = 10**6 # output is in microvolts
+
+
+""" Decoding """
+def decode1ChMacro(data):
+    """ Repack little endian 16 bit macro samples into signed 12 bit levels.
+    The converter value sits in the top 12 bits: (high << 4) | (low >> 4). """
+    raw = np.frombuffer(data, dtype='<i2', count=len(data) // 2)
+    return raw >> 4
+
+def decode1Ch(data):
+    """ 8 bit samples are already levels. """
+    return np.frombuffer(data, dtype=np.uint8)
+
+def toVolts(levels, fromRange, toRange=VOLT_RANGE):
+    """ Vectorised form of the scripts' getToRange lambda. """
+    fr, tr = fromRange, toRange
+    slope = float(tr[1] - tr[0]) / float(fr[1] - fr[0])
+    volts = tr[0] + slope * (np.asarray(levels, dtype=np.float64) - fr[0])
+    return np.round(SCALE * volts, 1)
+
+
+class BlockDecoder(object):
+    """ Decode and voltify raw blocks in one table lookup per sample. """
+
+    def __init__(self, macro=True, toRange=VOLT_RANGE):
+        self.macro = macro
+        self.toRange = toRange
+        if macro:
+            codes = np.arange(1 << 16, dtype=np.uint16).view(np.int16)
+            self.fromRange = MACRO_RANGE
+            self.rawType = np.dtype('<u2')
+            self.table = toVolts(codes >> 4, MACRO_RANGE, toRange)
+        else:
+            codes = np.arange(1 << 8, dtype=np.uint8)
+            self.fromRange = BYTE_RANGE
+            self.rawType = np.dtype(np.uint8)
+            self.table = toVolts(codes, BYTE_RANGE, toRange)
+        self.sampleSize = self.rawType.itemsize
+
+    def decode(self, data):
+        """ Levels for a block (no copy of the raw bytes). """
+        if self.macro:
+            return decode1ChMacro(data)
+        return decode1Ch(data)
+
+    def levelScale(self):
+        """ (scale, offset) such that volts = offset + scale * level. """
+        fr, tr = self.fromRange, self.toRange
+        scale = float(tr[1] - tr[0]) / float(fr[1] - fr[0])
+        return scale, tr[0] - scale * fr[0]
+
+    def samples(self, data):
+        """ Raw sample codes of a block, trailing partial sample dropped. """
+        return np.frombuffer(data, dtype=self.rawType,
+                             count=len(data) // self.sampleSize)
+
+    def voltify(self, data, out=None):
+        """ Microvolts for a block. Pass out to reuse an output array. """
+        raw = self.samples(data)
+        if out is None:
+            return self.table.take(raw)
+        return self.table.take(raw, out=out[:len(raw)])
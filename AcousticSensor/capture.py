@@ -0,0 +1,201 @@
+""" BitLib capture loops.
+
+All captures yield the samples of one trace at a time as a float64
+array that is only valid until the next one is requested. BitLib is not
+reentrant, so while a capture is running only it may call into the
+library. """
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from bitlib import (BL_AcquireInto, BL_Halt, BL_Mode, BL_Rate, BL_Size,
+                    BL_State, BL_Trace, BL_ASYNCHRONOUS, BL_MODE_STREAM,
+                    BL_STATE_ERROR, BL_TRACE_FORCED, BL_TRACE_FOREVER)
+
+from ring import SampleRing
+
+
+class SequentialCapture(object):
+    """ Trace, acquire, process, one after another in the caller's thread. """
+
+    def __init__(self, size, timeout=BL_TRACE_FORCED):
+        self.size = size
+        self.timeout = timeout
+        self.data = np.zeros(size)
+        self.rate = None
+        self.traces = 0
+        self.busy = 0.0 # seconds spent in trace + acquire
+        self.started = None
+        self.running = False
+
+    def start(self):
+        self.rate = BL_Rate()
+        self.started = time.time()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def dutyCycle(self):
+        """ Fraction of wall time the device spent capturing. """
+        elapsed = time.time() - self.started
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def __iter__(self):
+        while self.running:
+            start = time.time()
+            BL_Trace(self.timeout)
+            count = BL_AcquireInto(self.data)
+            self.busy += time.time() - start
+            self.traces += 1
+            yield self.data[:count]
+
+
+class DoubleBufferedCapture(SequentialCapture):
+    """ Trace N+1 on a worker thread while the caller processes trace N.
+
+    The worker cycles through a pool of preallocated buffers: it takes a
+    free one, traces and acquires into it (with the GIL released) and
+    hands it over as ready. A buffer goes back to the pool when the
+    caller asks for the next capture. """
+
+    def __init__(self, size, timeout=BL_TRACE_FORCED, buffers=2):
+        SequentialCapture.__init__(self, size, timeout)
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        for i in range(buffers):
+            self.free.put(np.zeros(size))
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        SequentialCapture.start(self)
+        self.thread = threading.Thread(target=self.captureLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.free.put(None) # wake the worker if it waits for a buffer
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def captureLoop(self):
+        try:
+            while self.running:
+                data = self.free.get()
+                if data is None:
+                    break
+                start = time.time()
+                BL_Trace(self.timeout)
+                count = BL_AcquireInto(data)
+                self.busy += time.time() - start
+                self.traces += 1
+                self.ready.put((data, count))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.put(None)
+
+    def __iter__(self):
+        previous = None
+        while True:
+            if previous is not None:
+                self.free.put(previous)
+                previous = None
+            item = self.ready.get()
+            if item is None:
+                break
+            previous, count = item
+            yield previous[:count]
+        if self.error is not None:
+            raise self.error
+
+
+class StreamCapture(SequentialCapture):
+    """ Gapless STREAM mode acquisition.
+
+    A worker thread keeps the device streaming and pulls whatever it has
+    into a SampleRing, numbering every sample. The caller reads fixed
+    size blocks back out of the ring by sequence number; samples the
+    ring overwrote before they were read are counted in lost and samples
+    the device never delivered (streaming restarted after an error) in
+    shortfall(). seq is the sequence number of the last block yielded. """
+
+    def __init__(self, size, rate, chunk=1024, capacity=None, poll=0.001):
+        SequentialCapture.__init__(self, size)
+        self.rate = rate
+        self.chunk = np.zeros(chunk)
+        self.ring = SampleRing(capacity or 8 * max(size, chunk))
+        self.poll = poll
+        self.seq = 0
+        self.lost = 0
+        self.restarts = 0
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        BL_Mode(BL_MODE_STREAM)
+        BL_Rate(self.rate)
+        BL_Size(len(self.chunk))
+        SequentialCapture.start(self)
+        BL_Trace(BL_TRACE_FOREVER, BL_ASYNCHRONOUS)
+        self.thread = threading.Thread(target=self.streamLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        BL_Halt()
+        self.ring.close()
+
+    def shortfall(self):
+        """ Samples the device should have produced by now but did not. """
+        expected = int((time.time() - self.started) * self.rate)
+        return max(0, expected - self.ring.head - len(self.chunk))
+
+    def dutyCycle(self):
+        """ Fraction of the expected samples that reached the caller. """
+        received = self.ring.head - self.lost
+        missing = self.lost + self.shortfall()
+        return float(received) / (received + missing) if received > 0 else 0.0
+
+    def streamLoop(self):
+        try:
+            while self.running:
+                if BL_State() == BL_STATE_ERROR:
+                    BL_Halt()
+                    BL_Trace(BL_TRACE_FOREVER, BL_ASYNCHRONOUS)
+                    self.restarts += 1
+                    continue
+                count = BL_AcquireInto(self.chunk)
+                if count > 0:
+                    self.ring.write(self.chunk[:count])
+                    self.traces += 1
+                else:
+                    time.sleep(self.poll)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ring.close()
+
+    def __iter__(self):
+        out = np.empty(self.size)
+        seq = 0
+        while self.ring.wait(seq, self.size):
+            self.seq, data, lost = self.ring.read(seq, self.size, out)
+            self.lost += lost
+            seq = self.seq + len(data)
+            yield data
+        if self.error is not None:
+            raise self.error
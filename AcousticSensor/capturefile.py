@@ -0,0 +1,172 @@
+""" Chunked binary capture files of ADC levels.
+
+A capture file is a file header, then one chunk per block appended as it
+arrives, then an index of the chunks written when the file is closed:
+
+    header   4s B B H d    magic b"ACAP", version, channel, flags, created
+    chunk    d Q d d d I I  startTime, first sample number, sampleRate,
+                            scale, offset, count, reserved
+             count <i2      levels, volts = offset + scale * level
+    ...
+    index    Q d d I I     per chunk: file offset, startTime, sampleRate,
+                            count, reserved
+    trailer  Q I 4s        index offset, chunks, magic b"ACIX"
+
+Blocks are written as they are, int16 straight from the decoder, so
+appending costs one write. Reopening a closed file for append drops its
+index and carries on; a file that was never closed (no trailer) is
+indexed by walking its chunk headers, and a torn last chunk is ignored.
+
+CaptureReader maps the file and slices any time range out of it through
+the index, touching only the chunks in the range. """
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC = b"ACAP"
+INDEX_MAGIC = b"ACIX"
+CAPTURE_VERSION = 1
+HEADER = struct.Struct("<4sBBHd")
+CHUNK = struct.Struct("<dQdddII")
+INDEX = np.dtype([("position", "<u8"), ("startTime", "<f8"), ("sampleRate", "<f8"),
+                  ("count", "<u4"), ("reserved", "<u4")])
+TRAILER = struct.Struct("<QI4s")
+SAMPLE = np.dtype("<i2")
+
+ChunkHeader = namedtuple("ChunkHeader", "startTime seq sampleRate scale offset count")
+
+
+def sampleAt(header, t):
+    """ Index of the first sample of a chunk at or after time t. """
+    return int(np.ceil(round((t - header.startTime) * header.sampleRate, 6)))
+
+
+class CaptureWriter(object):
+    """ Appends blocks of levels to a capture file, creating it if needed. """
+
+    def __init__(self, path, channel=0):
+        self.path = path
+        self.index = []
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            # Carry on from the last whole chunk, overwriting the old index
+            reader = CaptureReader(path)
+            self.index = reader.index.tolist()
+            end, self.seq = reader.end, reader.samples
+            reader.close()
+            self.file = open(path, "r+b")
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, CAPTURE_VERSION, channel, 0, time.time()))
+            self.seq = 0 # number of the next sample
+
+    def append(self, levels, startTime, sampleRate, scale=1.0, offset=0.0):
+        samples = np.asarray(levels).astype(SAMPLE, copy=False)
+        self.index.append((self.file.tell(), startTime, sampleRate, len(samples), 0))
+        self.file.write(CHUNK.pack(startTime, self.seq, sampleRate, scale, offset, len(samples), 0))
+        self.file.write(samples.tobytes())
+        self.seq += len(samples)
+
+    def appendVolts(self, volts, startTime, sampleRate):
+        """ Append float voltages, quantised to 16 bits over the block's own span. """
+        volts = np.asarray(volts, dtype=np.float64)
+        low, high = (float(volts.min()), float(volts.max())) if len(volts) else (0.0, 0.0)
+        offset = (high + low) / 2
+        scale = (high - low) / 65534 or 1.0
+        self.append(np.rint((volts - offset) / scale), startTime, sampleRate, scale, offset)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """ Write the index and trailer. """
+        if self.file.closed:
+            return
+        position = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX).tobytes())
+        self.file.write(TRAILER.pack(position, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+
+class CaptureReader(object):
+    """ Memory mapped view of a capture file.
+
+    index is an INDEX array of the chunks, end the file offset just past
+    the last chunk and samples the number of samples in the file. """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+        if size < HEADER.size:
+            raise ValueError("Capture file too short: %d bytes" % size)
+        magic, version, self.channel, flags, self.created = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("Not a capture file")
+        if version != CAPTURE_VERSION:
+            raise ValueError("Unsupported capture version %d" % version)
+        self.index, self.end = self.readIndex(size)
+        self.samples = int(self.chunk(len(self.index) - 1)[0].seq + self.index["count"][-1]) if len(self.index) else 0
+        # Each chunk's end, for searching by time
+        self.endTimes = self.index["startTime"] + self.index["count"] / self.index["sampleRate"]
+
+    def readIndex(self, size):
+        """ (index, end of the chunks) from the trailer, or by walking the chunks. """
+        if size >= HEADER.size + TRAILER.size:
+            position, count, magic = TRAILER.unpack_from(self.map, size - TRAILER.size)
+            if magic == INDEX_MAGIC and position + count * INDEX.itemsize + TRAILER.size == size:
+                return np.frombuffer(self.map, INDEX, count, position), position
+        entries = []
+        position = HEADER.size
+        while position + CHUNK.size <= size:
+            header = ChunkHeader(*CHUNK.unpack_from(self.map, position)[:6])
+            end = position + CHUNK.size + header.count * SAMPLE.itemsize
+            if end > size:
+                break
+            entries.append((position, header.startTime, header.sampleRate, header.count, 0))
+            position = end
+        return np.array(entries, dtype=INDEX), position
+
+    def __len__(self):
+        return len(self.index)
+
+    def chunk(self, i):
+        """ (ChunkHeader, int16 view of its levels in the map). """
+        position = int(self.index["position"][i])
+        header = ChunkHeader(*CHUNK.unpack_from(self.map, position)[:6])
+        return header, np.frombuffer(self.map, SAMPLE, header.count, position + CHUNK.size)
+
+    def chunks(self, start=None, end=None):
+        """ (ChunkHeader, levels) for the parts of the chunks between start and end (unix times). """
+        first = 0 if start is None else int(np.searchsorted(self.endTimes, start, side="right"))
+        last = len(self.index) if end is None else int(np.searchsorted(self.index["startTime"], end, side="left"))
+        for i in range(first, last):
+            header, levels = self.chunk(i)
+            low = 0 if start is None else max(0, sampleAt(header, start))
+            high = header.count if end is None else min(header.count, sampleAt(header, end))
+            if high > low:
+                yield header._replace(startTime=header.startTime + low / header.sampleRate,
+                                      seq=header.seq + low, count=high - low), levels[low:high]
+
+    def read(self, start=None, end=None):
+        """ (times, volts) of every sample from start up to end. """
+        parts = list(self.chunks(start, end))
+        times = np.empty(sum(header.count for header, levels in parts))
+        volts = np.empty(len(times))
+        at = 0
+        for header, levels in parts:
+            times[at:at + header.count] = header.startTime + np.arange(header.count) / header.sampleRate
+            volts[at:at + header.count] = header.offset + header.scale * levels
+            at += header.count
+        return times, volts
+
+    def close(self):
+        self.index = self.index.copy() # don't hold the map open
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
@@ -0,0 +1,81 @@
+""" Binary acoustic frames for MQTT publishes.
+
+A frame is a fixed little endian header followed by raw int16 samples:
+
+    magic       2s  b"AF"
+    version     B   FRAME_VERSION
+    channel     B
+    flags       H   reserved, 0
+    sampleRate  d   Hz
+    seq         Q   frame sequence number
+    startTime   d   unix time of the first sample
+    scale       d   volts = offset + scale * sample
+    offset      d
+    count       I   number of samples that follow
+
+This module is both the device side encoder and the decoder for
+consumers of /AcousticSensor. """
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+
+MAGIC = b"AF"
+FRAME_VERSION = 1
+HEADER = struct.Struct("<2sBBHdQdddI")
+SAMPLE = np.dtype("<i2")
+
+FrameHeader = namedtuple("FrameHeader", "version channel flags sampleRate seq startTime scale offset count")
+
+
+""" Encoding """
+def encodeFrame(levels, scale, offset, sampleRate, channel=0, seq=0, startTime=None):
+    """ Frame integer levels that already fit in int16 (e.g. 12 bit ADC levels). """
+    if startTime is None:
+        startTime = time.time()
+    samples = np.asarray(levels).astype(SAMPLE, copy=False)
+    header = HEADER.pack(MAGIC, FRAME_VERSION, channel, 0, sampleRate, seq,
+                         startTime, scale, offset, len(samples))
+    return header + samples.tobytes()
+
+def encodeVolts(volts, sampleRate, channel=0, seq=0, startTime=None):
+    """ Frame float voltages, quantised to 16 bits over the frame's own span. """
+    volts = np.asarray(volts, dtype=np.float64)
+    if len(volts):
+        low, high = float(volts.min()), float(volts.max())
+    else:
+        low = high = 0.0
+    offset = (high + low) / 2
+    scale = (high - low) / 65534 or 1.0
+    levels = np.rint((volts - offset) / scale)
+    return encodeFrame(levels, scale, offset, sampleRate, channel, seq, startTime)
+
+
+""" Decoding """
+def decodeHeader(payload):
+    if len(payload) < HEADER.size:
+        raise ValueError("Frame too short: %d bytes" % len(payload))
+    fields = HEADER.unpack_from(payload)
+    if fields[0] != MAGIC:
+        raise ValueError("Not an acoustic frame")
+    if fields[1] != FRAME_VERSION:
+        raise ValueError("Unsupported frame version %d" % fields[1])
+    header = FrameHeader(*fields[1:])
+    if len(payload) < HEADER.size + SAMPLE.itemsize * header.count:
+        raise ValueError("Frame truncated: %d of %d samples" % (
+            (len(payload) - HEADER.size) // SAMPLE.itemsize, header.count))
+    return header
+
+def decodeFrame(payload):
+    """ Returns (header, samples) with samples an int16 view of the payload. """
+    header = decodeHeader(payload)
+    samples = np.frombuffer(payload, dtype=SAMPLE, count=header.count, offset=HEADER.size)
+    return header, samples
+
+def toVolts(header, samples):
+    return header.offset + header.scale * samples.astype(np.float64)
+
+def sampleTimes(header):
+    """ Unix time of every sample in the frame. """
+    return header.startTime + np.arange(header.count) / header.sampleRate
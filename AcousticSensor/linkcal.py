@@ -0,0 +1,75 @@
+""" Serial link throughput checks for the BitScope stream.
+
+A serial link carries at most baud / 10 bytes per second (8N1) and in
+practice less. A sample rate that needs more than that does not fail, it
+just loses data, so the rate is checked against the link before the
+stream starts: either against the nominal rate of the configured baud
+or against the rate measured by calibrate(). """
+import time
+
+BAUD_RATES = (115200, 230400, 460800, 921600)
+MARGIN = 0.9 # share of the link a stream may use
+
+
+def linkByteRate(baud):
+    """ Nominal bytes/s of an 8N1 serial link. """
+    return baud / 10.0
+
+def bytesPerSecond(sampleRate, macro, channels=1, frameSize=None):
+    """ Link bytes/s a stream needs, frame tokens included. """
+    rate = float(sampleRate) * channels * (2 if macro else 1)
+    if frameSize:
+        rate *= frameSize / (frameSize - 1.0)
+    return rate
+
+def maxSampleRate(byteRate, macro, channels=1, frameSize=None, margin=MARGIN):
+    """ Highest sample rate that fits in margin of byteRate. """
+    return int(byteRate * margin / bytesPerSecond(1, macro, channels, frameSize))
+
+def checkRate(sampleRate, byteRate, macro, channels=1, frameSize=None, margin=MARGIN, strict=False):
+    """ Warn, or raise ValueError if strict, when sampleRate needs more than
+    the link sustains. Returns the highest sample rate that fits. """
+    best = maxSampleRate(byteRate, macro, channels, frameSize, margin)
+    if sampleRate > best:
+        message = ("Sample rate %d Hz needs %.0f bytes/s but the link sustains %.0f bytes/s,"
+                   " samples will be dropped (%d Hz fits)" % (
+                       sampleRate, bytesPerSecond(sampleRate, macro, channels, frameSize),
+                       byteRate, best))
+        if strict:
+            raise ValueError(message)
+        print ("WARNING: " + message)
+    return best
+
+def measureByteRate(source, seconds=2.0, readSize=4096):
+    """ Bytes/s read from source (a serial port, or a StreamParser to count
+    only well framed sample bytes) over seconds. The device must already
+    be streaming faster than the link can carry. """
+    buf = bytearray(readSize)
+    total = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        total += source.readinto(buf) or 0
+    return total / (time.time() - start)
+
+def calibrate(ser, measure, bauds=BAUD_RATES):
+    """ Call measure() -> bytes/s with ser at each baud in turn and leave ser
+    at the baud that moved the most data. Returns (baud, byte rate,
+    {baud: byte rate}). Bauds that fail to open or carry nothing are
+    left out. """
+    results = {}
+    for baud in bauds:
+        try:
+            ser.baudrate = baud
+            ser.reset_input_buffer()
+            rate = measure()
+        except (IOError, OSError, ValueError) as e:
+            print ("Link: %d baud unusable (%s)" % (baud, e))
+            continue
+        if rate > 0:
+            results[baud] = rate
+    if not results:
+        raise IOError("No baud rate carried the stream")
+    best = max(results, key=lambda baud: (results[baud], baud))
+    ser.baudrate = best
+    ser.reset_input_buffer()
+    return best, results[best], results
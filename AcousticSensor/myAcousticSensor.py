@@ -4,100 +4,78 @@ import logging
 import time
 import argparse
 
-import threading
-import struct
-from collections import deque
+import os
 import sys
 
-from datetime import datetime
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+from bsdecode import BlockDecoder
+from ring import BlockRing, BLOCK, DROP_OLDEST, DROP_NEWEST
+from pipeline import Pipeline
+from streamparser import StreamParser
+from shmpipeline import ProcessPipeline
+from frames import encodeFrame
+from windowstats import encodeSummary, windowStats
+from spectrum import Spectrogram, encodeSpectra
+from trigger import EventTrigger
+from capturefile import CaptureWriter
+from linkcal import BAUD_RATES, calibrate, checkRate, linkByteRate, maxSampleRate, measureByteRate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from uplink import SOCKET_PATH, UplinkClient
 
 """ User Parameters """
 sampleRate = 20000 # hz per channel
 channels = 1 # 1 is ch A alone, 2 is both
 macro = True # 12 bit or not
 fileName = "data"
+captureSamples = False # write every block's samples to the capture file, only when workers is 0
+ringSlots = 32 # serial blocks buffered between the reader and the decoder
+overflowPolicy = DROP_OLDEST # BLOCK, DROP_OLDEST or DROP_NEWEST when the ring is full
+binaryPayload = True # publish binary frames (see frames.py) rather than CSV text
+statsWindow = 2000 # samples per window of the statistics published on /AcousticSensor/stats
+publishRaw = False # publish the samples themselves on /AcousticSensor as well
+spectrumSize = 1024 # samples per FFT frame of the band energies on /AcousticSensor/spectrum, 0 for none
+spectrumHop = 512 # samples between frame starts
+# The event trigger keeps history across blocks, so it needs workers = 0
+triggerLevel = None # volts that trigger an event on /AcousticSensor/event, None for no level trigger
+triggerBands = None # band energies in V^2 (mean square volts in each spectrum band, inf to ignore) that trigger an event, None for none
+preTrigger = 0.5 # seconds of history kept in an event before its trigger
+postTrigger = 1.0 # seconds after the trigger
+eventDir = "./events" # where events are saved as frames
+workers = 0 # decoder processes fed through shared memory, 0 decodes in this process
+calibrateLink = False # measure the link at each of baudRates at startup and keep the fastest
+baudRates = BAUD_RATES
+rateCheck = "warn" # "warn", "refuse" or "fit" (lower sampleRate) when the link can't carry sampleRate
 
 """ Internal """
-running = True
 ser = serial.Serial("/dev/ttyUSB0", 115200, timeout=1.0)
 serWaiting = 0
-dataQueue = deque()
+blockSize = 20000 # bytes per serial read
+decoder = BlockDecoder(macro, (-5, 5))
+scale, offset = decoder.levelScale()
+spectrogram = Spectrogram(sampleRate, spectrumSize, spectrumHop) if spectrumSize else None
+trigger = EventTrigger(sampleRate, int(preTrigger * sampleRate), int(postTrigger * sampleRate),
+                       triggerLevel, triggerBands, scale, offset, blockSize // 2) \
+    if triggerLevel is not None or triggerBands is not None else None
+lastSeq = None # block the spectrogram and trigger carried samples from
 frameToken = "af"
+frameSize = None # bytes from one frame token to the next, None learns it from the stream
+calibrationRate = 1000000 # sample clock while calibrating, faster than any link
+calibrationTime = 2.0 # seconds measured per baud
 tickRate = 0
-filePath = "./" + fileName + ".txt"
+filePath = "./" + fileName + ".cap" # see capturefile.py
+capture = None
 readCount = 600
 
 ####################################################
 
-# Custom MQTT message callback
-def customCallback(client, userdata, message):
-    print("Received a new message: ")
-    print(message.payload)
-    print("from topic: ")
-    print(message.topic)
-    print("--------------\n\n")
-
-
 # Read in command-line parameters
 parser = argparse.ArgumentParser()
-parser.add_argument("-e", "--endpoint", action="store", required=True, dest="host", help="Your AWS IoT custom endpoint")
-parser.add_argument("-r", "--rootCA", action="store", required=True, dest="rootCAPath", help="Root CA file path")
-parser.add_argument("-c", "--cert", action="store", dest="certificatePath", help="Certificate file path")
-parser.add_argument("-k", "--key", action="store", dest="privateKeyPath", help="Private key file path")
-parser.add_argument("-w", "--websocket", action="store_true", dest="useWebsocket", default=False,
-                    help="Use MQTT over WebSocket")
-parser.add_argument("-id", "--clientId", action="store", dest="clientId", default="basicPubSub",
-                    help="Targeted client id")
-parser.add_argument("-t", "--topic", action="store", dest="topic", default="sdk/test/Python", help="Targeted topic")
-
+parser.add_argument("-u", "--uplink", action="store", dest="uplinkPath", default=SOCKET_PATH,
+                    help="Socket of the uplink daemon (uplink.py) that owns the AWS IoT connection")
 args = parser.parse_args()
-host = args.host
-rootCAPath = args.rootCAPath
-certificatePath = args.certificatePath
-privateKeyPath = args.privateKeyPath
-useWebsocket = args.useWebsocket
-clientId = args.clientId
-topic = args.topic
-
-if args.useWebsocket and args.certificatePath and args.privateKeyPath:
-    parser.error("X.509 cert authentication and WebSocket are mutual exclusive. Please pick one.")
-    exit(2)
-
-if not args.useWebsocket and (not args.certificatePath or not args.privateKeyPath):
-    parser.error("Missing credentials for authentication.")
-    exit(2)
 
-# Configure logging
-logger = logging.getLogger("AWSIoTPythonSDK.core")
-logger.setLevel(logging.DEBUG)
-streamHandler = logging.StreamHandler()
-#formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-#streamHandler.setFormatter(formatter)
-#logger.addHandler(streamHandler)
-
-# Init AWSIoTMQTTClient
-myAWSIoTMQTTClient = None
-if useWebsocket:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId, useWebsocket=True)
-    myAWSIoTMQTTClient.configureEndpoint(host, 443)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath)
-else:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-    myAWSIoTMQTTClient.configureEndpoint(host, 8883)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
-
-# AWSIoTMQTTClient connection configuration
-myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
-myAWSIoTMQTTClient.configureDrainingFrequency(100)  # Draining: 2 Hz
-myAWSIoTMQTTClient.configureConnectDisconnectTimeout(300)  # 5 mins
-myAWSIoTMQTTClient.configureMQTTOperationTimeout(120)  # 2 mins
-
-# Connect and subscribe to AWS IoT
-myAWSIoTMQTTClient.connect()
-myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
-time.sleep(0.1)
+# Publish through the uplink daemon, which also spools while offline
+uplink = UplinkClient(args.uplinkPath)
 
 ##################################################
 
@@ -132,28 +110,14 @@ def clearWaiting():
 
 """ Utilities """
 def freqToHexTicks(freq):
-    ticks = int((freq ** -1) / 0.000000025)
+    """ (low, high) register bytes in hex of the 40 MHz clock ticks per sample. """
+    ticks = int(round((freq ** -1) / 0.000000025))
     print(ticks)
-    hexTicks = hex(ticks)[2:]
-    zeroAdds = "0" * (4 % len(hexTicks))
-    combined = zeroAdds + hexTicks
+    if not 0 < ticks <= 0xffff:
+        raise ValueError("%d Hz is %d clock ticks, outside the 16 bit tick register" % (freq, ticks))
+    combined = "%04x" % ticks
     return combined[2:], combined[:2]
     
-def getToRange(fromRange, toRange):
-    fr, tr = fromRange, toRange
-    slope = float(tr[1] - tr[0]) / float(fr[1] - fr[0])
-    return lambda v : round((10**6) * (tr[0] + slope * float(v - fr[0])), 1)
-    
-""" Decoding """
-def decode1ChMacro(data):
-    unpackArg = "<" + str(int(len(data) / 2)) + "h"
-    unpacked = list(struct.unpack(unpackArg, data))
-    for i in unpacked:
-        a = (i & 0x00ff) >> 4
-        b = (i & 0xff00) << 4
-        i = a + b
-    return unpacked
-
 def setupBS():
     """ Standard setup procedure. """
     if channels == 1:
@@ -178,62 +142,158 @@ def setupBS():
     readAll()
     
 def startStream():
-    read(2) # ?!?!?!
+    # Whatever precedes the first frame is skipped by the parser
     issueWait("T")
     
-def readLoop():
+def measureLink():
+    """ Sample bytes/s the link carries with the device streaming flat out. """
+    global tickRate
+    configured, tickRate = tickRate, calibrationRate
+    try:
+        setupBS()
+        startStream()
+        return measureByteRate(StreamParser(ser, bytearray.fromhex(frameToken), frameSize), calibrationTime)
+    finally:
+        tickRate = configured
+        issueWait(".")
+        readAll()
+    
+def fitSampleRate(linkRate):
+    """ Check sampleRate against the link's bytes/s as rateCheck says. """
+    global sampleRate, tickRate, spectrogram, trigger
+    best = checkRate(sampleRate, linkRate, macro, channels, frameSize, strict = rateCheck == "refuse")
+    if rateCheck == "fit" and sampleRate > best:
+        sampleRate = best
+        tickRate = sampleRate * 2 if macro else sampleRate
+        if spectrogram is not None:
+            spectrogram = Spectrogram(sampleRate, spectrumSize, spectrumHop)
+        if trigger is not None:
+            trigger = EventTrigger(sampleRate, int(preTrigger * sampleRate), int(postTrigger * sampleRate),
+                                   triggerLevel, triggerBands, scale, offset, blockSize // 2)
+        print ("Sample rate lowered to %d Hz" % sampleRate)
+    
+def reportResync(offset, skipped):
+    print ("Stream resync at byte %d, %d bytes skipped" % (offset, skipped))
+    
+def readSetup():
+    """ Runs in the reader thread before its first read. """
     setupBS()
     startStream()
-    while running:
-        data = bytearray()
-        toGet = 20000                   # Take 44000 samples in 1 second
-        data = ser.read(toGet)
-        dataQueue.append(data)
-        time.sleep(1)
         
-def writeToFile(file, data, count):
-    # Write to file
+def toCsv(data):
     dataStr = ','.join(map(str, data))
     #for i in range(len(data)/100):
      #   print data[i]
     strData = dataStr + ',' + '\n'
-    toWrite = str(datetime.now()) + '\n'
-    file.write(toWrite)
     return strData
     
+def processBlock(data, seq, startTime):
+    """ [(topic, payload)] for one serial block. Runs in a worker process if workers > 0. """
+    levelData = decoder.decode(data)
+    if capture is not None:
+        capture.append(levelData, startTime, sampleRate, scale, offset)
+    stats = windowStats(levelData, statsWindow, sampleRate, startTime, scale, offset)
+    messages = [("/AcousticSensor/stats", encodeSummary(stats, sampleRate, statsWindow, seq=seq))]
+    # Samples only carry over from the block before when this process decoded it
+    global lastSeq
+    gap = lastSeq is None or seq != lastSeq + 1
+    lastSeq = seq
+    spectra = None
+    if spectrogram is not None:
+        if gap:
+            spectrogram.reset()
+        spectra = spectrogram.update(offset + scale * levelData, startTime)
+        messages.append(("/AcousticSensor/spectrum", encodeSpectra(spectra, spectrogram.edges, seq=seq)))
+    if trigger is not None:
+        if gap:
+            trigger.reset()
+        for event in trigger.feed(levelData, startTime, spectra):
+            messages.append(("/AcousticSensor/event", saveEvent(event)))
+    if publishRaw and binaryPayload:
+        # Frame the raw levels
+        messages.append(("/AcousticSensor", encodeFrame(levelData, scale, offset, sampleRate, seq=seq, startTime=startTime)))
+    elif publishRaw:
+        # Voltify
+        voltData = decoder.voltify(data)
+        messages.append(("/AcousticSensor", toCsv(voltData.tolist())))
+    return messages
+
+def saveEvent(event):
+    """ Frame of an event's samples, also written to eventDir. """
+    payload = encodeFrame(event.levels, scale, offset, sampleRate, seq=trigger.events, startTime=event.startTime)
+    path = os.path.join(eventDir, "%d-%s.bin" % (event.triggerTime * 1000, event.reason))
+    with open(path, "wb") as f:
+        f.write(payload)
+    print ("Event: %s trigger at %.3f, %d samples from %.3f" % (
+        event.reason, event.triggerTime, len(event.levels), event.startTime))
+    return payload
+
+def payloads(pipeline):
+    """ (seq, messages) for every block, built by the workers or right here. """
+    if workers:
+        return iter(pipeline)
+    return ((seq, processBlock(data, seq, time.time())) for seq, data in enumerate(pipeline))
+    
 def main():
+    global capture
+    if trigger is not None and workers:
+        # Each worker sees every workers-th block, never the history an event needs
+        print ("Not starting: the event trigger needs every block in order, set workers = 0")
+        sys.exit(1)
+    if captureSamples and workers:
+        # The workers decode the blocks, this process never sees their samples
+        print ("Not starting: captureSamples writes the blocks in this process, set workers = 0")
+        sys.exit(1)
+    # Stop BS and clear out serial buffer
+    issueWait(".")
+    readAll()
+    linkRate = linkByteRate(ser.baudrate)
+    if calibrateLink:
+        baud, linkRate, measured = calibrate(ser, measureLink, baudRates)
+        for each in sorted(measured):
+            print ("Link: %d baud carries %.0f bytes/s" % (each, measured[each]))
+        print ("Link: using %d baud, up to %d Hz" % (baud, maxSampleRate(linkRate, macro, channels, frameSize)))
+    try:
+        fitSampleRate(linkRate)
+    except ValueError as e:
+        print ("Not starting: %s" % e)
+        sys.exit(1)
+    if trigger is not None and not os.path.isdir(eventDir):
+        os.makedirs(eventDir)
+    streamParser = StreamParser(ser, bytearray.fromhex(frameToken), frameSize, onResync = reportResync)
+    if workers:
+        pipeline = ProcessPipeline(ringSlots, blockSize, streamParser.readinto, processBlock,
+                                   workers, readSetup, overflowPolicy)
+    else:
+        pipeline = Pipeline(BlockRing(ringSlots, blockSize, overflowPolicy), streamParser.readinto, readSetup)
+    if captureSamples:
+        capture = CaptureWriter(filePath)
     try :
-        dumpFile = open(filePath, 'w')
-        # Stop BS and clear out serial buffer
-        issueWait(".")
-        readAll()
-        # Open read stream thread
-        readThread = threading.Thread(target = readLoop)
-        readThread.start()
+        # Open read stream thread (or reader and worker processes)
+        pipeline.start()
         # Start writing loop in main thread
-
-        decodeFn = decode1ChMacro
-        fromRange = (-32768, 32767)
-        toRangeLambda = getToRange(fromRange, (-5, 5))
         
-        counter = 0
-        while True:
-            #time.sleep(0.1)
-            while len(dataQueue):
-                # Pop data
-                data = dataQueue.popleft()
-                # Decode
-                levelData = decodeFn(data)
-                # Voltify
-                voltData = list(map(toRangeLambda, levelData))
-                # Write
-                messageObject = writeToFile(dumpFile, voltData, counter)
-                myAWSIoTMQTTClient.publish("/AcousticSensor", messageObject, 1)
+        # Sleeps until the next payload is ready
+        for counter, messages in payloads(pipeline):
+            # QoS and priority come from the uplink daemon's topic table
+            for messageTopic, messageObject in messages:
+                uplink.publish(messageTopic, messageObject)
     
     except (KeyboardInterrupt, Exception) as e:
-        running = False
         print (e)
-        print ("Program terminated successfully")
+    # Stop the reader after its current read
+    pipeline.stop(2 * ser.timeout)
+    if capture is not None:
+        capture.close()
+    if not workers:
+        print ("Stream: %d frames, %d resyncs, %d bytes skipped" % (
+            streamParser.frames, len(streamParser.resyncs), streamParser.skipped))
+    if trigger is not None:
+        print ("Trigger: %d events" % trigger.events)
+    print ("Ring: %(produced)d blocks read, %(dropped)d dropped, high water %(highWater)d of %(slots)d" % pipeline.stats())
+    uplink.close()
+    print ("Uplink: %d sent, %d dropped" % (uplink.sent, uplink.dropped))
+    print ("Program terminated successfully")
         
 if __name__ == '__main__':
     main()
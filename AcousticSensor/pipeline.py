@@ -0,0 +1,72 @@
+""" Reader thread to consumer pipeline over a BlockRing.
+
+The reader thread fills ring blocks from the serial link, the caller's
+thread blocks in the ring until a block is ready and processes it.
+Nobody polls: both sides sleep on the ring's condition until there is
+work, so an idle pipeline uses no CPU and the reader is not competing
+with a spinning consumer for the GIL. """
+import threading
+
+
+class Pipeline(object):
+    """ read(view) fills a block and returns the bytes written, setup() is
+    called once in the reader thread before the first read. Iterate over
+    the pipeline to consume blocks:
+
+        pipeline = Pipeline(ring, ser.readinto, readSetup)
+        for data in pipeline:
+            ...
+    """
+
+    def __init__(self, ring, read, setup=None):
+        self.ring = ring
+        self.read = read
+        self.setup = setup
+        self.stopping = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def readLoop(self):
+        try:
+            if self.setup is not None:
+                self.setup()
+            while not self.stopping.is_set():
+                slot, view = self.ring.acquire()
+                if view is None:
+                    break
+                self.ring.commit(slot, self.read(view))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ring.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.readLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __iter__(self):
+        """ Blocks in arrival order until stopped, then what was already read.
+        Each block is only valid until the next one is requested. """
+        if self.thread is None:
+            self.start()
+        while True:
+            slot, data = self.ring.get()
+            if slot is None:
+                break
+            try:
+                yield data
+            finally:
+                self.ring.release(slot)
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return self.ring.stats()
+
+    def stop(self, timeout=None):
+        """ Ask the reader to finish its current read and exit. """
+        self.stopping.set()
+        self.ring.close()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,210 @@
+""" Preallocated ring buffers shared between a capture thread and its consumer. """
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+BLOCK = "block" # producer waits for the consumer
+DROP_OLDEST = "drop-oldest" # oldest unread block is overwritten
+DROP_NEWEST = "drop-newest" # incoming block is discarded
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class SampleRing(object):
+    """ Fixed size ring of samples addressed by absolute sequence number.
+
+    The writer never blocks: when the ring is full the oldest samples are
+    overwritten. A reader asking for samples that are already gone gets
+    the oldest ones still held and the number it missed. """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype)
+        self.head = 0 # sequence number of the next sample written
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def oldest(self):
+        """ Sequence number of the oldest sample still held. """
+        return max(0, self.head - self.capacity)
+
+    def write(self, samples):
+        n = len(samples)
+        with self.cond:
+            if n > self.capacity:
+                self.head += n - self.capacity
+                samples = samples[n - self.capacity:]
+                n = self.capacity
+            start = self.head % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = samples[:first]
+            self.data[:n - first] = samples[first:]
+            self.head += n
+            self.cond.notify_all()
+
+    def close(self):
+        """ Wake any waiting reader for good. """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def wait(self, seq, count=1, timeout=None):
+        """ Block until count samples from seq are written (or the ring closes).
+        Returns True if they are there. """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.head < seq + count and not self.closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.head >= seq + count
+
+    def read(self, seq, count, out=None):
+        """ Copy up to count samples starting at seq.
+
+        Returns (seq, samples, lost) where seq is the sequence number of
+        the first sample returned (later than asked if samples were lost
+        to overrun) and lost is how many were skipped. """
+        with self.cond:
+            oldest = self.oldest()
+            lost = 0
+            if seq < oldest:
+                lost = oldest - seq
+                seq = oldest
+            n = max(0, min(count, self.head - seq))
+            if out is None:
+                out = np.empty(n, self.data.dtype)
+            out = out[:n]
+            start = seq % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.data[start:start + first]
+            out[first:] = self.data[:n - first]
+        return seq, out, lost
+
+
+class BlockRing(object):
+    """ Fixed number of preallocated byte blocks passed from a producer to a consumer.
+
+    The producer fills a block in place and commits it:
+
+        slot, view = ring.acquire()
+        ring.commit(slot, ser.readinto(view))
+
+    and the consumer takes committed blocks in order, releasing each
+    one when done with it:
+
+        slot, data = ring.get()
+        ...
+        ring.release(slot)
+
+    When every block is in use the overflow policy decides whether the
+    producer waits, the oldest unread block is reused or the new block
+    is thrown away. Memory use never grows past the preallocated blocks. """
+
+    def __init__(self, slots, blockSize, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy %r" % policy)
+        self.slots = slots
+        self.blockSize = blockSize
+        self.policy = policy
+        self.buffers = [bytearray(blockSize) for i in range(slots)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.lengths = [0] * slots
+        self.free = deque(range(slots))
+        self.filled = deque() # committed slots, oldest first
+        self.scratch = memoryview(bytearray(blockSize)) # written then dropped
+        self.cond = threading.Condition()
+        self.closed = False
+        self.produced = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.highWater = 0
+
+    def __len__(self):
+        return len(self.filled)
+
+    def stats(self):
+        with self.cond:
+            return {"produced": self.produced, "consumed": self.consumed,
+                    "dropped": self.dropped, "highWater": self.highWater,
+                    "queued": len(self.filled), "slots": self.slots,
+                    "policy": self.policy}
+
+    def acquire(self, timeout=None):
+        """ (slot, writable view) of an empty block for the producer.
+        Slot is None when the block will be dropped on commit, and the
+        view is None if the ring closed or the wait timed out. """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while not self.free and not self.closed:
+                if self.policy == DROP_OLDEST and self.filled:
+                    self.free.append(self.filled.popleft())
+                    self.dropped += 1
+                    break
+                if self.policy != BLOCK:
+                    return None, self.scratch
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                self.cond.wait(remaining)
+            if self.closed:
+                return None, None
+            slot = self.free.popleft()
+        return slot, self.views[slot]
+
+    def commit(self, slot, length):
+        """ Hand a filled block to the consumer. """
+        with self.cond:
+            self.produced += 1
+            if slot is None:
+                self.dropped += 1
+                return
+            if not length:
+                self.produced -= 1
+                self.free.appendleft(slot)
+                return
+            self.lengths[slot] = length
+            self.filled.append(slot)
+            self.highWater = max(self.highWater, len(self.filled))
+            self.cond.notify_all()
+
+    def put(self, data, timeout=None):
+        """ Copy data into a block and commit it. """
+        slot, view = self.acquire(timeout)
+        if view is None:
+            return False
+        length = min(len(data), self.blockSize)
+        view[:length] = data[:length]
+        self.commit(slot, length)
+        return slot is not None
+
+    def get(self, timeout=None):
+        """ (slot, view) of the oldest committed block, or
+        (None, None) if there is none within timeout or the ring closed. """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while not self.filled and not self.closed:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                self.cond.wait(remaining)
+            if not self.filled:
+                return None, None
+            slot = self.filled.popleft()
+            self.consumed += 1
+        return slot, self.views[slot][:self.lengths[slot]]
+
+    def release(self, slot):
+        """ Give a block back once the consumer is done with it. """
+        with self.cond:
+            self.free.append(slot)
+            self.cond.notify_all()
+
+    def close(self):
+        """ Stop handing out empty blocks and wake everyone up. Blocks
+        already committed can still be taken with get(). """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
@@ -0,0 +1,190 @@
+""" Multi-process acquisition over a shared memory block ring.
+
+A reader process fills fixed size blocks of one shared memory segment
+straight from the serial link. Worker processes take blocks by slot
+index, handle them in place and return the slot; only slot numbers and
+the (small) handler results go through queues, never the raw bytes.
+Decoding therefore runs on as many cores as there are workers instead
+of sharing one interpreter's GIL with the reader.
+
+The processes are forked (Linux only) so they inherit the open serial
+port and whatever state the handler needs. Needs Python 3.8 or later. """
+import multiprocessing
+import signal
+import time
+from multiprocessing import shared_memory
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ring import BLOCK, DROP_OLDEST, DROP_NEWEST, POLICIES
+
+WAIT = 0.1 # seconds between checks of the stop flag while waiting
+
+
+class SharedBlockRing(object):
+    """ slots blocks of blockSize bytes in one shared memory segment, plus
+    queues of free slot numbers and of filled (slot, length, seq, time). """
+
+    def __init__(self, slots, blockSize, ctx):
+        self.slots = slots
+        self.blockSize = blockSize
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * blockSize)
+        self.free = ctx.Queue()
+        self.filled = ctx.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def view(self, slot, length=None):
+        start = slot * self.blockSize
+        return self.shm.buf[start:start + (self.blockSize if length is None else length)]
+
+    def destroy(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ProcessPipeline(object):
+    """ Reader process -> SharedBlockRing -> worker processes.
+
+    read(view) fills a block and returns the bytes written, setup() runs
+    once in the reader process first. handle(data, seq, startTime) runs
+    in a worker for every block with data a memoryview into shared
+    memory, valid only during the call; its return value is passed back.
+    Iterate over the pipeline for (seq, result) in completion order. """
+
+    def __init__(self, slots, blockSize, read, handle, workers=None, setup=None, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy %r" % policy)
+        self.ctx = multiprocessing.get_context("fork")
+        self.ring = SharedBlockRing(slots, blockSize, self.ctx)
+        self.read = read
+        self.handle = handle
+        self.workers = workers or max(1, multiprocessing.cpu_count() - 1)
+        self.setup = setup
+        self.policy = policy
+        self.results = self.ctx.Queue()
+        self.stopping = self.ctx.Event()
+        self.produced = self.ctx.Value("q", 0)
+        self.dropped = self.ctx.Value("q", 0)
+        self.highWater = self.ctx.Value("q", 0)
+        self.processes = []
+        self.running = 0 # workers that have not finished yet
+
+    def stats(self):
+        return {"produced": self.produced.value, "dropped": self.dropped.value,
+                "highWater": self.highWater.value, "slots": self.ring.slots,
+                "workers": self.workers, "policy": self.policy}
+
+    def nextSlot(self):
+        """ A slot to read into, None to read and drop, or False on stop. """
+        ring = self.ring
+        while not self.stopping.is_set():
+            try:
+                return ring.free.get_nowait()
+            except queue.Empty:
+                pass
+            if self.policy == DROP_NEWEST:
+                return None
+            if self.policy == DROP_OLDEST:
+                try:
+                    slot = ring.filled.get_nowait()[0]
+                    with self.dropped.get_lock():
+                        self.dropped.value += 1
+                    return slot
+                except queue.Empty:
+                    pass
+            try:
+                return ring.free.get(timeout=WAIT)
+            except queue.Empty:
+                pass
+        return False
+
+    def readLoop(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # the parent stops us
+        ring = self.ring
+        scratch = memoryview(bytearray(ring.blockSize))
+        if self.setup is not None:
+            self.setup()
+        seq = 0
+        try:
+            while True:
+                slot = self.nextSlot()
+                if slot is False:
+                    break
+                startTime = time.time()
+                length = self.read(scratch if slot is None else ring.view(slot))
+                if slot is None:
+                    with self.dropped.get_lock():
+                        self.dropped.value += 1
+                elif not length:
+                    ring.free.put(slot)
+                else:
+                    ring.filled.put((slot, length, seq, startTime))
+                    with self.produced.get_lock():
+                        self.produced.value += 1
+                    self.highWater.value = max(self.highWater.value, ring.filled.qsize())
+                    seq += 1
+        finally:
+            for i in range(self.workers):
+                ring.filled.put(None)
+
+    def workLoop(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        ring = self.ring
+        try:
+            while True:
+                item = ring.filled.get()
+                if item is None:
+                    break
+                slot, length, seq, startTime = item
+                data = ring.view(slot, length)
+                try:
+                    result = self.handle(data, seq, startTime)
+                finally:
+                    del data
+                    ring.free.put(slot)
+                self.results.put((seq, result))
+        finally:
+            self.results.put(None)
+
+    def start(self):
+        self.running = self.workers
+        self.processes = [self.ctx.Process(target=self.workLoop) for i in range(self.workers)]
+        self.processes.append(self.ctx.Process(target=self.readLoop))
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def __iter__(self):
+        if not self.processes:
+            self.start()
+        while self.running:
+            item = self.results.get()
+            if item is None:
+                self.running -= 1
+                continue
+            yield item
+
+    def stop(self, timeout=None):
+        """ Stop the reader, let the workers finish what was read (results
+        not yet taken are discarded), free the ring. """
+        self.stopping.set()
+        deadline = None if timeout is None else time.time() + timeout
+        while self.running:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                if self.results.get(timeout=remaining) is None:
+                    self.running -= 1
+            except queue.Empty:
+                break
+        for process in self.processes:
+            process.join(timeout)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        self.ring.destroy()
@@ -0,0 +1,91 @@
+""" Streaming short time spectra of acoustic blocks.
+
+Spectrogram cuts the sample stream into frames of nfft samples starting
+every hop samples, windows them and takes all the real FFTs of a block in
+one batched rfft. Frames overlap across block boundaries: the samples a
+block leaves after its last frame start are carried into the next, so a
+stream cut into 20000 byte blocks gives the same spectra as one long
+capture. Each frame is reduced to the energy in each of a set of
+frequency bands and its dominant frequency. """
+from collections import namedtuple
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Octave band edges in Hz, the last band runs up to the Nyquist frequency
+OCTAVE_EDGES = (0, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+Spectra = namedtuple("Spectra", "startTimes power bandEnergy dominant")
+
+
+class Spectrogram(object):
+    """ update(samples, startTime) -> Spectra for every frame that completes
+    in samples: startTimes (frames,), power (frames, nfft // 2 + 1), the
+    mean square of the windowed frame in each bin, bandEnergy (frames,
+    bands), its sum over each band, both in squared input units, and
+    dominant (frames,) in Hz. edges are band edges in Hz, at least one FFT bin apart (raises
+    ValueError otherwise). """
+
+    def __init__(self, sampleRate, nfft=1024, hop=512, edges=OCTAVE_EDGES):
+        if not 0 < hop <= nfft:
+            raise ValueError("hop must be 1 to nfft samples")
+        self.sampleRate = float(sampleRate)
+        self.nfft = nfft
+        self.hop = hop
+        self.window = np.hanning(nfft)
+        # Each bin's share of the frame's mean square, so the bins of a band
+        # sum to its energy and all of them to the signal's mean square. The
+        # other half of each bin is at the negative frequency, which DC and
+        # the Nyquist bin don't have.
+        self.norm = np.full(nfft // 2 + 1, 2.0 / (nfft * np.sum(self.window ** 2)))
+        self.norm[0] /= 2
+        if nfft % 2 == 0:
+            self.norm[-1] /= 2
+        self.freqs = np.fft.rfftfreq(nfft, 1 / self.sampleRate)
+        edges = [edge for edge in edges if edge < self.sampleRate / 2]
+        self.edges = edges + [self.sampleRate / 2]
+        self.bandStarts = np.searchsorted(self.freqs, edges)
+        # Each band needs a bin of its own, or reduceat would shift the energies
+        same = np.flatnonzero(np.diff(self.bandStarts) == 0)
+        if len(same):
+            raise ValueError("Band edges %g and %g Hz fall in one %.1f Hz FFT bin, nfft %d is too small" % (
+                edges[same[0]], edges[same[0] + 1], self.sampleRate / nfft, nfft))
+        self.tail = np.zeros(0)
+        self.tailTime = None # time of the first carried sample
+
+    def reset(self):
+        """ Forget the carried samples, e.g. after a gap in the stream. """
+        self.tail = np.zeros(0)
+        self.tailTime = None
+
+    def update(self, samples, startTime=0.0):
+        samples = np.asarray(samples, dtype=np.float64)
+        if self.tailTime is None:
+            self.tailTime = startTime
+        data = np.concatenate((self.tail, samples)) if len(self.tail) else samples
+        count = (len(data) - self.nfft) // self.hop + 1 if len(data) >= self.nfft else 0
+        frames = as_strided(data, shape=(count, self.nfft),
+                            strides=(self.hop * data.strides[0], data.strides[0]), writeable=False)
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2 * self.norm
+        startTimes = self.tailTime + np.arange(count) * (self.hop / self.sampleRate)
+        # Carry what the next frame starts with
+        used = count * self.hop
+        self.tail = data[used:].copy()
+        self.tailTime += used / self.sampleRate
+        if count:
+            bandEnergy = np.add.reduceat(power, self.bandStarts, axis=1)
+            dominant = self.freqs[1 + np.argmax(power[:, 1:], axis=1)] # DC left out
+        else:
+            bandEnergy = np.zeros((0, len(self.bandStarts)))
+            dominant = np.zeros(0)
+        return Spectra(startTimes, power, bandEnergy, dominant)
+
+
+def encodeSpectra(spectra, edges, channel=0, seq=0):
+    """ JSON payload of the band energies and dominant frequencies. """
+    return json.dumps({"channel": channel, "seq": seq, "edges": [round(edge, 1) for edge in edges],
+                       "startTimes": [round(t, 6) for t in spectra.startTimes.tolist()],
+                       "bandEnergy": [[float("%.4g" % value) for value in row] for row in spectra.bandEnergy.tolist()],
+                       "dominant": [round(f, 1) for f in spectra.dominant.tolist()]},
+                      separators=(",", ":"))
@@ -0,0 +1,138 @@
+""" Incremental parser for the token framed BitScope sample stream.
+
+setupBS programs a stream data token (register 0x36). The stream is
+taken as frames of that token byte followed by a fixed number of sample
+bytes. The parser reads the serial link into one preallocated buffer,
+checks every frame starts with the token and hands out only the sample
+bytes, so a dropped or extra byte costs the frames around it instead of
+misaligning every sample after it.
+
+Sync is found (and found again after a glitch) at a token that has
+another token exactly one frame later. Each time sync is lost the stream
+offset and the number of bytes skipped are recorded in resyncs. """
+from collections import Counter
+
+
+class StreamParser(object):
+    """ token is the frame token byte, frameSize the bytes from one token
+    to the next (None learns it from the token spacing in the stream).
+    readinto(out) works like ser.readinto but returns sample bytes only.
+    onResync(offset, skipped) is called whenever sync is found again. """
+
+    def __init__(self, source, token, frameSize=None, readSize=4096, onResync=None):
+        self.source = source
+        self.onResync = onResync
+        self.token = token
+        self.frameSize = frameSize
+        self.readSize = readSize
+        self.buffer = None
+        self.view = None
+        self.fill = 0 # bytes held in the buffer
+        self.pos = 0 # next unparsed byte in the buffer
+        self.offset = 0 # stream offset of buffer[0]
+        self.pendingStart = self.pendingEnd = 0 # sample bytes not yet handed out
+        self.synced = False
+        self.frames = 0
+        self.skipped = 0
+        self.syncOffset = None # stream offset of the first frame
+        self.resyncs = [] # (stream offset sync was lost at, bytes skipped)
+        self.lostAt = None
+        self.lostSkipped = 0
+        if frameSize:
+            self.allocate(frameSize)
+
+    def allocate(self, frameSize):
+        self.frameSize = frameSize
+        old = self.view[:self.fill] if self.view is not None else b""
+        self.buffer = bytearray(max(self.readSize, len(old)) + 2 * frameSize)
+        self.view = memoryview(self.buffer)
+        self.view[:len(old)] = old
+
+    def learnFrameSize(self):
+        """ Most common spacing between tokens, once it clearly stands out. """
+        data = self.view[self.pos:self.fill].tobytes()
+        positions = []
+        at = data.find(self.token)
+        while at != -1:
+            positions.append(at)
+            at = data.find(self.token, at + 1)
+        spacings = Counter(b - a for a, b in zip(positions, positions[1:]))
+        if spacings:
+            size, count = spacings.most_common(1)[0]
+            if size > 2 and count >= 4 and count * 2 > len(positions):
+                return size
+        return None
+
+    def fillBuffer(self):
+        """ Move unparsed bytes to the front and read more. False on timeout. """
+        if self.buffer is None:
+            self.buffer = bytearray(4 * self.readSize)
+            self.view = memoryview(self.buffer)
+        if self.pos:
+            remaining = self.fill - self.pos
+            self.view[:remaining] = self.view[self.pos:self.fill]
+            self.offset += self.pos
+            self.fill = remaining
+            self.pos = 0
+        if self.fill == len(self.buffer):
+            # Nothing resembling a frame in a whole buffer, let it go
+            self.skipped += self.fill
+            self.offset += self.fill
+            self.fill = 0
+        count = self.source.readinto(self.view[self.fill:])
+        self.fill += count or 0
+        if not self.frameSize:
+            size = self.learnFrameSize()
+            if size:
+                self.allocate(size)
+        return bool(count)
+
+    def nextFrame(self):
+        """ Parse one frame from the buffer. False if more bytes are needed.
+        A frame is only taken once the next frame's token is seen too. """
+        size = self.frameSize
+        if not size:
+            return False
+        buf, token = self.buffer, self.token[0]
+        while self.fill - self.pos > size:
+            if buf[self.pos] == token and buf[self.pos + size] == token:
+                if not self.synced:
+                    self.synced = True
+                    if self.syncOffset is None:
+                        self.syncOffset = self.offset + self.pos
+                    else:
+                        self.resyncs.append((self.lostAt, self.lostSkipped))
+                        if self.onResync is not None:
+                            self.onResync(self.lostAt, self.lostSkipped)
+                self.pendingStart = self.pos + 1
+                self.pendingEnd = self.pos + size
+                self.pos += size
+                self.frames += 1
+                return True
+            if self.synced:
+                self.synced = False
+                self.lostAt = self.offset + self.pos
+                self.lostSkipped = 0
+            # Skip to the next token, or to the tail that could still start a frame
+            at = buf.find(token, self.pos + 1, self.fill - size)
+            if at == -1:
+                at = self.fill - size
+            self.skipped += at - self.pos
+            self.lostSkipped += at - self.pos
+            self.pos = at
+        return False
+
+    def readinto(self, out):
+        """ Fill out with aligned sample bytes. Returns the count written,
+        short only if the link timed out. """
+        want = len(out)
+        done = 0
+        while done < want:
+            if self.pendingEnd > self.pendingStart:
+                count = min(want - done, self.pendingEnd - self.pendingStart)
+                out[done:done + count] = self.view[self.pendingStart:self.pendingStart + count]
+                self.pendingStart += count
+                done += count
+            elif not self.nextFrame() and not self.fillBuffer():
+                break
+        return done
@@ -0,0 +1,112 @@
+""" Event triggered capture of acoustic transients.
+
+Every block of samples goes into a SampleRing holding the last few
+seconds. The trigger fires on the first sample whose level reaches
+level volts, or on the first spectrogram frame with a band's energy at or
+above its bandThresholds entry, and an Event is made of the pre samples
+before that point and the post samples from it once they have arrived.
+The trigger then rearms at the end of the event, so overlapping events
+are never made.
+
+Checking a block is one comparison over the whole block (or over its
+frames) and a searchsorted per event, never a Python loop per sample. """
+from collections import namedtuple
+
+import numpy as np
+
+from ring import SampleRing
+
+Event = namedtuple("Event", "seq triggerSeq startTime triggerTime reason levels")
+
+
+class EventTrigger(object):
+    """ feed(levels, startTime, spectra=None) -> [Event] completed by this block.
+
+    levels are ADC levels (volts = offset + scale * level), kept in the
+    ring as they are. Sequence numbers count samples since the first
+    block fed. block is the most samples fed at once; longer blocks are
+    taken in pieces. """
+
+    def __init__(self, sampleRate, pre, post, level=None, bandThresholds=None,
+                 scale=1.0, offset=0.0, block=10000, dtype=np.int16):
+        self.sampleRate = float(sampleRate)
+        self.pre = pre
+        self.post = post
+        self.level = level
+        self.bandThresholds = None if bandThresholds is None else np.asarray(bandThresholds, np.float64)
+        self.scale = scale
+        self.offset = offset
+        self.block = block
+        self.ring = SampleRing(pre + post + block, dtype)
+        self.armedAt = 0 # first sample that may trigger
+        self.pending = [] # (triggerSeq, reason) waiting for their post samples
+        self.startTime = None # time of sample 0
+        self.events = 0
+        self.triggers = 0
+
+    def reset(self):
+        """ Forget the history, e.g. after a gap in the stream. """
+        self.ring = SampleRing(self.ring.capacity, self.ring.data.dtype)
+        self.armedAt = 0
+        self.pending = []
+        self.startTime = None
+
+    def levelCrossings(self, levels):
+        """ Indices of levels at or beyond level volts. """
+        if self.level is None:
+            return np.zeros(0, np.int64)
+        # |offset + scale * x| >= level, in levels so the block is never converted
+        low = (-self.level - self.offset) / self.scale
+        high = (self.level - self.offset) / self.scale
+        low, high = min(low, high), max(low, high)
+        return np.flatnonzero((levels <= low) | (levels >= high))
+
+    def bandCrossings(self, spectra, startTime, head):
+        """ Sequence numbers of the spectrogram frames over their band thresholds. """
+        if self.bandThresholds is None or spectra is None or not len(spectra.startTimes):
+            return np.zeros(0, np.int64)
+        fired = np.any(spectra.bandEnergy >= self.bandThresholds, axis=1)
+        starts = head + np.round((spectra.startTimes[fired] - startTime) * self.sampleRate)
+        return np.maximum(starts.astype(np.int64), 0)
+
+    def feed(self, levels, startTime=0.0, spectra=None):
+        levels = np.asarray(levels)
+        events = []
+        for first in range(0, max(len(levels), 1), self.block):
+            piece = levels[first:first + self.block]
+            pieceTime = startTime + first / self.sampleRate
+            if self.startTime is None:
+                self.startTime = pieceTime
+            head = self.ring.head
+            level = self.levelCrossings(piece) + head
+            band = self.bandCrossings(spectra, startTime, head) if first == 0 else level[:0]
+            # Level and band crossings in sample order, level first on a tie
+            crossings = np.concatenate((level, band))
+            reasons = np.concatenate((np.zeros(len(level), np.int8), np.ones(len(band), np.int8)))
+            order = np.lexsort((reasons, crossings))
+            self.arm(crossings[order], reasons[order])
+            self.ring.write(piece)
+            events.extend(self.complete())
+        return events
+
+    def arm(self, crossings, reasons):
+        """ Pending triggers from sorted crossings, each at least an event after the last. """
+        at = np.searchsorted(crossings, self.armedAt)
+        while at < len(crossings):
+            seq = int(crossings[at])
+            self.pending.append((seq, "level" if reasons[at] == 0 else "band"))
+            self.triggers += 1
+            self.armedAt = seq + self.post
+            at = np.searchsorted(crossings, self.armedAt)
+
+    def complete(self):
+        """ Events whose post samples have all arrived. """
+        events = []
+        while self.pending and self.pending[0][0] + self.post <= self.ring.head:
+            triggerSeq, reason = self.pending.pop(0)
+            first = max(0, triggerSeq - self.pre)
+            seq, levels, lost = self.ring.read(first, triggerSeq + self.post - first)
+            events.append(Event(seq, triggerSeq, self.startTime + seq / self.sampleRate,
+                                self.startTime + triggerSeq / self.sampleRate, reason, levels))
+            self.events += 1
+        return events
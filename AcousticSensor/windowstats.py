@@ -0,0 +1,68 @@
+""" Windowed statistics of acoustic blocks, for publishing instead of samples.
+
+A block of samples is cut into windows of a fixed number of samples and
+each window is reduced to its min, max, mean, RMS, peak to peak and crest
+factor (peak / RMS), all in volts. A 20000 sample block summarised over
+2000 sample windows is 10 rows of 6 numbers. The work is one pass of
+numpy reductions over a (windows, window) view of the block; a last
+window shorter than the rest is summarised on its own.
+
+The statistics are worked out on the integer ADC levels and then scaled,
+so the block is never converted to volts sample by sample. """
+import json
+
+import numpy as np
+
+FIELDS = ("startTime", "count", "min", "max", "mean", "rms", "p2p", "crest")
+STATS = np.dtype([(field, np.float64) for field in FIELDS])
+
+
+def reduceWindows(levels):
+    """ (min, max, sum, sum of squares) of each row of a 2D array. """
+    wide = levels.astype(np.float64)
+    return (levels.min(axis=1), levels.max(axis=1), wide.sum(axis=1),
+            np.einsum("ij,ij->i", wide, wide))
+
+def windowStats(levels, window, sampleRate, startTime=0.0, scale=1.0, offset=0.0):
+    """ STATS rows for every window of levels (volts = offset + scale * level). """
+    levels = np.asarray(levels)
+    full = len(levels) // window
+    parts = [levels[:full * window].reshape(full, window)]
+    counts = [np.full(full, window)]
+    if len(levels) > full * window:
+        parts.append(levels[full * window:].reshape(1, -1))
+        counts.append(np.array([len(levels) - full * window]))
+    rows = np.zeros(sum(len(c) for c in counts), dtype=STATS)
+    at = 0
+    for part, count in zip(parts, counts):
+        if not len(count):
+            continue
+        low, high, total, squares = reduceWindows(part)
+        mean = total / count
+        rows["count"][at:at + len(count)] = count
+        rows["min"][at:at + len(count)] = offset + scale * (low if scale >= 0 else high)
+        rows["max"][at:at + len(count)] = offset + scale * (high if scale >= 0 else low)
+        rows["mean"][at:at + len(count)] = offset + scale * mean
+        # mean of (offset + scale * x) ** 2, expanded so it only needs the sums
+        meanSquare = offset * offset + 2 * offset * scale * mean + scale * scale * squares / count
+        rows["rms"][at:at + len(count)] = np.sqrt(np.maximum(meanSquare, 0))
+        at += len(count)
+    rows["startTime"] = startTime + np.arange(len(rows)) * (float(window) / sampleRate)
+    rows["p2p"] = rows["max"] - rows["min"]
+    peak = np.maximum(np.abs(rows["min"]), np.abs(rows["max"]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rows["crest"] = np.where(rows["rms"] > 0, peak / rows["rms"], 0.0)
+    return rows
+
+def encodeSummary(rows, sampleRate, window, channel=0, seq=0):
+    """ JSON payload for STATS rows, volts to the microvolt. """
+    return json.dumps({"channel": channel, "seq": seq, "sampleRate": sampleRate,
+                       "window": window, "fields": FIELDS,
+                       "stats": [[round(float(value), 6) for value in row] for row in rows.tolist()]},
+                      separators=(",", ":"))
+
+def decodeSummary(payload):
+    """ (summary dict without the stats, STATS rows) from encodeSummary's payload. """
+    summary = json.loads(payload)
+    rows = np.array([tuple(row) for row in summary.pop("stats")], dtype=STATS)
+    return summary, rows
@@ -0,0 +1,96 @@
+""" Messages/s through the uplink under each publish policy.
+
+StandInBroker plays AWSIoTMQTTClient against a broker rtt seconds away
+over a link of bandwidth bytes/s: publish() returns once the message is
+on the wire, after a further round trip for a QoS 1 PUBACK, and
+publishAsync() calls back with the PUBACK a round trip after the send.
+The policies are the old one (QoS 1, one PUBACK at a time), QoS 1
+through InflightWindow at a few window sizes, and QoS 0.
+
+Run with: python bench_uplink.py [seconds] [rtt] """
+import heapq
+import sys
+import threading
+import time
+
+from uplink import InflightWindow
+
+BANDWIDTH = 1 << 20 # bytes/s up
+PAYLOADS = (('temperature batch', 600), ('acoustic frame', 40064))
+
+
+class StandInBroker(object):
+
+    def __init__(self, rtt, bandwidth=BANDWIDTH):
+        self.rtt = rtt
+        self.bandwidth = float(bandwidth)
+        self.lock = threading.Lock()
+        self.wire_free = 0.0 # when the link finishes sending what it has
+        self.mid = 0
+        self.acks = [] # heap of (due, mid, callback)
+        self.cond = threading.Condition()
+        self.delivered = 0
+        thread = threading.Thread(target=self.ack_loop)
+        thread.daemon = True
+        thread.start()
+
+    def transmit(self, payload):
+        """ Wait until payload is on the wire, return when that was. """
+        with self.lock:
+            self.wire_free = max(self.wire_free, time.time()) + len(payload) / self.bandwidth
+            done = self.wire_free
+        time.sleep(max(0, done - time.time()))
+        self.delivered += 1
+        return done
+
+    def publish(self, topic, payload, qos):
+        self.transmit(payload)
+        if qos:
+            time.sleep(self.rtt)
+        return True
+
+    def publishAsync(self, topic, payload, qos, ackCallback=None):
+        sent = self.transmit(payload)
+        with self.cond:
+            self.mid += 1
+            heapq.heappush(self.acks, (sent + self.rtt, self.mid, ackCallback))
+            self.cond.notify()
+            return self.mid
+
+    def ack_loop(self):
+        while True:
+            with self.cond:
+                while not self.acks or self.acks[0][0] > time.time():
+                    self.cond.wait(self.acks[0][0] - time.time() if self.acks else None)
+                due, mid, callback = heapq.heappop(self.acks)
+            if callback is not None:
+                callback(mid)
+
+
+def measure(name, publish, payload, seconds):
+    done = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        publish('/bench', payload)
+        done += 1
+    rate = done / float(seconds)
+    print('  %-16s %8.1f msgs/s %10.0f bytes/s' % (name, rate, rate * len(payload)))
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    rtt = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    print('Broker round trip %.0f ms, link %d KB/s' % (rtt * 1000, BANDWIDTH >> 10))
+    for label, size in PAYLOADS:
+        payload = bytes(bytearray(size))
+        print('%s (%d bytes):' % (label, size))
+        broker = StandInBroker(rtt)
+        measure('QoS 1 one by one', lambda topic, data: broker.publish(topic, data, 1), payload, seconds)
+        for window in (4, 16, 64):
+            inflight = InflightWindow(StandInBroker(rtt), window)
+            measure('QoS 1 window %d' % window, lambda topic, data: inflight.publish(topic, data, 1),
+                    payload, seconds)
+        broker = StandInBroker(rtt)
+        measure('QoS 0', lambda topic, data: broker.publish(topic, data, 0), payload, seconds)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+""" Report-by-exception for slow moving sensor readings.
+
+Room temperatures sit on the same value for long stretches (the exports
+are full of repeated 26.125s), so publishing every reading mostly sends
+nothing new. DeadbandPublisher forwards a reading only when it moved
+more than deadband from the last value sent for that sensor. Otherwise,
+once heartbeat seconds have passed since that sensor last sent anything,
+it sends the UNCHANGED marker instead of the value. A gap in a sensor's
+series therefore means "no data", while a marker means "still the last
+value". reconstruct() turns the markers back into values. """
+
+UNCHANGED = '=' # value of a heartbeat: same as the last value sent (within the deadband)
+
+
+class DeadbandPublisher(object):
+    """ Filters readings on their way to publisher (see mqttbatch), which
+    gets add(sensor, value, timestamp) for the readings worth sending.
+    A failed read (None) is sent once when it starts and once when it ends. """
+
+    def __init__(self, publisher, deadband=0.25, heartbeat=300.0):
+        self.publisher = publisher
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.last = {} # sensor id -> last value sent
+        self.sent_at = {} # sensor id -> time the sensor last sent a value or marker
+        self.reported = 0
+        self.markers = 0
+        self.suppressed = 0
+
+    def changed(self, sensor, value):
+        if sensor not in self.last:
+            return True
+        last = self.last[sensor]
+        if value is None or last is None:
+            return value is not last
+        return abs(value - last) > self.deadband
+
+    def add(self, sensor, value, timestamp):
+        if self.changed(sensor, value):
+            self.last[sensor] = value
+            self.reported += 1
+        elif timestamp - self.sent_at[sensor] >= self.heartbeat:
+            value = UNCHANGED
+            self.markers += 1
+        else:
+            self.suppressed += 1
+            return
+        self.sent_at[sensor] = timestamp
+        self.publisher.add(sensor, value, timestamp)
+
+    def flush(self):
+        self.publisher.flush()
+
+    def close(self):
+        self.publisher.close()
+
+
+def reconstruct(readings):
+    """ (time, sensor, value) readings with each UNCHANGED replaced by the
+    sensor's last value before it. Values between readings are the
+    earlier reading's, to within the deadband. """
+    last = {}
+    series = []
+    for t, sensor, value in readings:
+        if value == UNCHANGED:
+            value = last.get(sensor)
+        last[sensor] = value
+        series.append((t, sensor, value))
+    return series
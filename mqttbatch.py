@@ -0,0 +1,105 @@
+""" Batched MQTT publishing of sensor readings.
+
+A QoS 1 publish per reading costs a PUBACK round trip per reading, which
+at short sampling intervals caps the sampling rate. BatchPublisher
+collects readings and sends them as one message once max_count are
+waiting or the oldest has waited max_latency seconds, whichever comes
+first. Every reading keeps its own timestamp. close() sends whatever is
+left, so nothing is lost on shutdown. """
+import json
+import threading
+import time
+
+FIELDS = ['time', 'sensor', 'value'] # time in ms since the epoch, as in the dashboard exports
+
+
+def encode_batch(readings):
+    """ JSON payload for a list of (time in seconds, sensor id, value). """
+    return json.dumps({'fields': FIELDS,
+                       'readings': [[int(round(t * 1000)), sensor, value] for t, sensor, value in readings]},
+                      separators=(',', ':'))
+
+def decode_batch(payload):
+    """ [(time in seconds, sensor id, value)] from a batch payload. """
+    return [(t / 1000.0, sensor, value) for t, sensor, value in json.loads(payload)['readings']]
+
+
+class BatchPublisher(object):
+    """ Sends readings added with add() to topic in batches through client
+    (an AWSIoTMQTTClient or anything with publish(topic, payload, qos)). """
+
+    def __init__(self, client, topic, qos=1, max_count=50, max_latency=10.0):
+        self.client = client
+        self.topic = topic
+        self.qos = qos
+        self.max_count = max_count
+        self.max_latency = max_latency
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock() # held from taking a batch to sending it, so batches go out in order
+        self.readings = []
+        self.oldest = None # when the oldest waiting reading was added
+        self.closed = False
+        self.batches = 0
+        self.published = 0
+        self.latency = 0.0 # seconds the oldest reading of the last batch waited
+        self.thread = threading.Thread(target=self.flush_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def take(self):
+        """ The waiting readings, emptying the batch. Call holding cond. """
+        readings, self.readings = self.readings, []
+        latency = time.time() - self.oldest if readings else 0.0
+        self.oldest = None
+        return readings, latency
+
+    def send(self):
+        """ Take the waiting readings and publish them as one batch. """
+        with self.send_lock:
+            with self.cond:
+                readings, latency = self.take()
+            if not readings:
+                return
+            self.client.publish(self.topic, encode_batch(readings), self.qos)
+            self.batches += 1
+            self.published += len(readings)
+            self.latency = latency
+
+    def add(self, sensor, value, timestamp=None):
+        with self.cond:
+            if self.closed:
+                raise ValueError('Publisher is closed')
+            self.readings.append((time.time() if timestamp is None else timestamp, sensor, value))
+            if self.oldest is None:
+                self.oldest = time.time()
+                self.cond.notify()
+            if len(self.readings) < self.max_count:
+                return
+        self.send()
+
+    def flush_loop(self):
+        """ Sends a batch once its oldest reading has waited max_latency. """
+        while True:
+            with self.cond:
+                while not self.closed:
+                    if self.oldest is None:
+                        self.cond.wait()
+                        continue
+                    remaining = self.oldest + self.max_latency - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if self.closed:
+                    return
+            self.send()
+
+    def flush(self):
+        self.send()
+
+    def close(self):
+        """ Stop the timer and send what is left. """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
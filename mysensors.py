@@ -15,7 +15,6 @@
  */
  '''
 
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 import logging
 import time
 import argparse
@@ -26,22 +25,31 @@ import time
 import sys
 import signal
 import RPi.GPIO as GPIO
+import w1therm
+from mqttbatch import BatchPublisher
+from deadband import DeadbandPublisher
+from uplink import SOCKET_PATH, UplinkClient
 
 os.system('modprobe w1-gpio')
 os.system('modprobe w1-therm')
 
-# Folder directory definitions
-BASE_DIR = '/sys/bus/w1/devices/'
-DEVICE_FOLDER = ['1', '1', '1']
-FILE_OPENED = ['1', '1', '1']
-
-SENSOR_COUNT = 0
-SENSORS = ['1', '1', '1']
-for name in glob.glob(BASE_DIR + '28*'):
-    DEVICE_FOLDER[SENSOR_COUNT] = name + '/w1_slave'
-    SENSORS[SENSOR_COUNT] = DEVICE_FOLDER[SENSOR_COUNT].split('00000')[1].split('/')[0]
-    SENSOR_COUNT += 1
-print('Available sensors: {0} {1} {2}'. format(SENSORS[0], SENSORS[1], SENSORS[2]))
+# Sensors on the bus, read concurrently
+DEVICES = w1therm.discover()
+SENSORS = sorted(DEVICES)
+print('Available sensors: {0}'.format(' '.join(SENSORS)))
+# Resolution in bits (9 to 12) per sensor id, 9 bits converts 8x faster than 12
+# Sensors left out keep their current resolution
+RESOLUTIONS = {}
+# Readings go out together once BATCH_SIZE are waiting or the oldest is BATCH_LATENCY s old
+BATCH_SIZE = 30
+BATCH_LATENCY = 10.0
+# Only send readings that moved more than DEADBAND C, plus an "unchanged" marker
+# every HEARTBEAT s; None sends every reading
+DEADBAND = 0.25
+HEARTBEAT = 300.0
+# Adapt each sensor's interval to how fast it changes, between these bounds in s,
+# starting at the shortest; None asks for one interval for every sensor
+ADAPTIVE = (1.0, 60.0)
 
 # LED PINs
 LED = 2
@@ -54,22 +62,6 @@ GPIO.setup(LED, GPIO.OUT)
 #Initilise LEDs
 GPIO.output(LED, 0)
 
-def read_temp_raw(sensor):
-    f = open(sensor, 'r')
-    lines = f.readlines()
-    f.close()
-    return lines
-
-def read_temp(sensor, speed):
-    lines = read_temp_raw(sensor)
-    equals_pos = lines[1].find('t=')
-    
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos+2:]
-        temp_c = float(temp_string) / 1000.0
-##    time.sleep(int(speed))
-    return temp_c
-
 def set_sampling_time():
     print('Time for sampling should be set in scaled of seconds')
     print(16*'*')
@@ -77,104 +69,61 @@ def set_sampling_time():
     print(16*'*')
     return samplingTimes
 
-def live_sampling(sensor, speed, fileWrite) :
-    data = read_temp(sensor, speed)
-    #fileWrite.write('{0}\n'.format(data))
-    return data
 ####################################################
 
-# Custom MQTT message callback
-def customCallback(client, userdata, message):
-    print("Received a new message: ")
-    print(message.payload)
-    print("from topic: ")
-    print(message.topic)
-    print("--------------\n\n")
-
-
 # Read in command-line parameters
 parser = argparse.ArgumentParser()
-parser.add_argument("-e", "--endpoint", action="store", required=True, dest="host", help="Your AWS IoT custom endpoint")
-parser.add_argument("-r", "--rootCA", action="store", required=True, dest="rootCAPath", help="Root CA file path")
-parser.add_argument("-c", "--cert", action="store", dest="certificatePath", help="Certificate file path")
-parser.add_argument("-k", "--key", action="store", dest="privateKeyPath", help="Private key file path")
-parser.add_argument("-w", "--websocket", action="store_true", dest="useWebsocket", default=False,
-                    help="Use MQTT over WebSocket")
-parser.add_argument("-id", "--clientId", action="store", dest="clientId", default="basicPubSub",
-                    help="Targeted client id")
-parser.add_argument("-t", "--topic", action="store", dest="topic", default="sdk/test/Python", help="Targeted topic")
-
+parser.add_argument("-u", "--uplink", action="store", dest="uplinkPath", default=SOCKET_PATH,
+                    help="Socket of the uplink daemon (uplink.py) that owns the AWS IoT connection")
 args = parser.parse_args()
-host = args.host
-rootCAPath = args.rootCAPath
-certificatePath = args.certificatePath
-privateKeyPath = args.privateKeyPath
-useWebsocket = args.useWebsocket
-clientId = args.clientId
-topic = args.topic
-
-if args.useWebsocket and args.certificatePath and args.privateKeyPath:
-    parser.error("X.509 cert authentication and WebSocket are mutual exclusive. Please pick one.")
-    exit(2)
 
-if not args.useWebsocket and (not args.certificatePath or not args.privateKeyPath):
-    parser.error("Missing credentials for authentication.")
-    exit(2)
-
-# Configure logging
-logger = logging.getLogger("AWSIoTPythonSDK.core")
-logger.setLevel(logging.DEBUG)
-streamHandler = logging.StreamHandler()
-#formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-#streamHandler.setFormatter(formatter)
-#logger.addHandler(streamHandler)
-
-# Init AWSIoTMQTTClient
-myAWSIoTMQTTClient = None
-if useWebsocket:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId, useWebsocket=True)
-    myAWSIoTMQTTClient.configureEndpoint(host, 443)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath)
-else:
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-    myAWSIoTMQTTClient.configureEndpoint(host, 8883)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
-
-# AWSIoTMQTTClient connection configuration
-myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)  # Infinite offline Publish queueing
-myAWSIoTMQTTClient.configureDrainingFrequency(2)  # Draining: 2 Hz
-myAWSIoTMQTTClient.configureConnectDisconnectTimeout(300)  # 5 mins
-myAWSIoTMQTTClient.configureMQTTOperationTimeout(120)  # 2 mins
-
-# Connect and subscribe to AWS IoT
-myAWSIoTMQTTClient.connect()
-myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
-time.sleep(2)
+# Publish through the uplink daemon, which also spools while offline
+myUplink = UplinkClient(args.uplinkPath)
 
 # Publish to the same topic in a loop forever
 loopCount = 0
 
 def main():
-    sensorSamplingRate = set_sampling_time()
-    print(sensorSamplingRate)
-
+    if ADAPTIVE:
+        # Every sensor starts at the shortest interval and adapts from there
+        sensorSamplingRate = ADAPTIVE[0]
+    else:
+        sensorSamplingRate = set_sampling_time()
+        print(sensorSamplingRate)
+
+    poller = w1therm.Poller(DEVICES, resolutions=RESOLUTIONS)
+    print('Bulk conversion: {0}'.format('on' if poller.bulk() else 'off'))
+    for sensor in SENSORS:
+        print('Sensor {0}: {1} bit'.format(sensor, poller.resolutions[sensor]))
+    # No point sampling faster than the sensors convert
+    interval = max(float(sensorSamplingRate), poller.conversion_time())
+    print('Sampling every {0} s'.format(interval))
+    publisher = BatchPublisher(myUplink, "/TemperatureSensors", 1, BATCH_SIZE, BATCH_LATENCY)
+    reporter = publisher
+    if DEADBAND is not None:
+        reporter = DeadbandPublisher(publisher, DEADBAND, HEARTBEAT)
+    def reading(sensor, temp, due):
+        print('Sensor {0} is {1}'.format(sensor, temp))
+        reporter.add(sensor, temp, due)
+    def missed(sensor, count):
+        print('Sensor {0} missed {1} sample(s)'.format(sensor, count))
+    adaptive = w1therm.AdaptiveRate(*ADAPTIVE) if ADAPTIVE else None
+    scheduler = w1therm.Scheduler(poller, interval, on_reading=reading, on_missed=missed, adaptive=adaptive)
     try:
-        temp = [1, 1, 1]
-        while True:
-            for i in range(3):
-                temp[i] = live_sampling(DEVICE_FOLDER[i], sensorSamplingRate, "")
-                print('Sensor {0} is {1}'.format(SENSORS[i], temp[i]))
-            messageObject = ("{0} : {1},{2} : {3},{4} : {5}".
-                             format(SENSORS[0], temp[0], SENSORS[1], temp[1],
-                                    SENSORS[2], temp[2]))
-            print ("*" * 16)
-
-            myAWSIoTMQTTClient.publish("/TemperatureSensors", messageObject, 1)
-            time.sleep(int(sensorSamplingRate)) 
+        # Sensors due together are read in one poll, in one conversion time
+        scheduler.run()
             
     except (KeyboardInterrupt, Exception) as e:
         print(e)
+        poller.close()
+        # Send what is still waiting
+        publisher.close()
+        myUplink.close()
+        print('Published {0} readings in {1} batches'.format(publisher.published, publisher.batches))
+        print('Uplink: {0} sent, {1} dropped'.format(myUplink.sent, myUplink.dropped))
+        if reporter is not publisher:
+            print('Deadband: {0} changes, {1} heartbeats, {2} readings suppressed'.format(
+                reporter.reported, reporter.markers, reporter.suppressed))
         print("Program successfully terminated")
         
         
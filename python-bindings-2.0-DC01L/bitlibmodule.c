@@ -25,6 +25,10 @@
  * won't miss them. If you do miss them you can add them yourself
  * as the library still implement them.
  *
+ * Note#3 BL_Trace, BL_Acquire and BL_AcquireInto release the GIL while
+ * the device is busy so other Python threads keep running. BitLib is
+ * not reentrant: only one thread at a time may call into it.
+ *
  * Somewhat non-standard code formatting conventions are used here.
  * Fontification makes it easier to read (if you really want to) */
 
@@ -52,7 +56,7 @@ BL_Mode, BL_Offset, BL_Enable, BL_Rate,\n\
 BL_Time, BL_Size BL_Intro and BL_Trigger.\n\n\
 Trace performs the actual data capture via BL_Trace.\n\n\
 Acquire reads the captured data from the device channel by channel and\n\
-uses BL_SelectChannel, BL_Index and BL_Acquire.";
+uses BL_SelectChannel, BL_Index and BL_Acquire (or BL_AcquireInto).";
 
 static char bitlib_BL_Acquire_doc[] = "BL_Acquire(N, D) -> N\nBL_Acquire(N) -> D\nBL_Acquire() -> D\n\n\
 Reads N samples from the selected device (BL_Select) and\n\
@@ -75,7 +79,9 @@ static PyObject * bitlib_BL_Acquire ( PyObject * self, PyObject * args ) {
 		PyErr_SetString(PyExc_TypeError, "Second argument should be a list."); 
 		return NULL;
 	} else { int i; double D[N];
+		Py_BEGIN_ALLOW_THREADS
 		N = BL_Acquire( N, D );
+		Py_END_ALLOW_THREADS
 		if ( N > 0 ) {
 			if ( ! L ) {
 				L = PyList_New(N);
@@ -90,6 +96,36 @@ static PyObject * bitlib_BL_Acquire ( PyObject * self, PyObject * args ) {
 	}
 }
 
+static char bitlib_BL_AcquireInto_doc[] = "BL_AcquireInto(B, N) -> N\nBL_AcquireInto(B) -> N\n\n\
+Reads N samples from the selected device (BL_Select) and channel\n\
+directly into B, a writable contiguous buffer of doubles such as\n\
+array('d') or a float64 NumPy array. Returns N samples (possibly\n\
+updated value). If N is omitted it is the length of B. No objects\n\
+are created per sample so B may be reused from capture to capture.";
+static PyObject * bitlib_BL_AcquireInto ( PyObject * self, PyObject * args ) {
+	PyObject * B; Py_buffer V; Py_ssize_t S; int N = 0;
+	if ( ! PyArg_ParseTuple(args, "O|i:BL_AcquireInto", &B, &N) )
+		return NULL;
+	if ( PyObject_GetBuffer(B, &V, PyBUF_CONTIG | PyBUF_FORMAT) < 0 )
+		return NULL;
+	if ( V.itemsize != sizeof(double) || ! V.format ||
+		( strcmp(V.format,"d") && strcmp(V.format,"<d") && strcmp(V.format,"=d") && strcmp(V.format,"@d") ) ) {
+		PyBuffer_Release(&V);
+		PyErr_SetString(PyExc_TypeError, "Buffer should hold doubles (format 'd').");
+		return NULL;
+	}
+	S = V.len / V.itemsize;
+	if ( N <= 0 || N > S )
+		N = (int) S;
+	if ( N > 0 ) {
+		Py_BEGIN_ALLOW_THREADS
+		N = BL_Acquire( N, (double *) V.buf );
+		Py_END_ALLOW_THREADS
+	}
+	PyBuffer_Release(&V);
+	return PyInt_FromLong( (long) N );
+}
+
 static char bitlib_BL_Size_doc[] = "BL_Size(S) -> N\n\n\
 Returns N, the number of samples to be captured (per frame) at the\n\
 prevailing sample rate (BL_Rate) and duration (BL_Time)\n\
@@ -324,9 +360,12 @@ commenced successfully, false otherwise. If T is zero or omitted,\n\
 perform a forced trigger trace immediately. If T is negative, do\n\
 the trace with infinite timeout but do it execute aysnchronously.";
 static PyObject * bitlib_BL_Trace ( PyObject * self, PyObject * args ) {
-	double timeout = BL_TRACE_FORCED; bool async = BL_SYNCHRONOUS;
+	double timeout = BL_TRACE_FORCED; bool async = BL_SYNCHRONOUS, ok;
 	if ( !PyArg_ParseTuple(args, "|db:BL_Trace", &timeout, &async) ) return NULL;
-	if ( BL_Trace(timeout,async) ) Py_RETURN_TRUE; else Py_RETURN_FALSE;
+	Py_BEGIN_ALLOW_THREADS
+	ok = BL_Trace(timeout,async);
+	Py_END_ALLOW_THREADS
+	if ( ok ) Py_RETURN_TRUE; else Py_RETURN_FALSE;
 }
 
 static char bitlib_BL_Version_doc[] = "BL_Version(T) -> V\n\n\
@@ -342,6 +381,7 @@ static PyObject * bitlib_BL_Version ( PyObject * self, PyObject * args ) {
 
 static PyMethodDef bitlib_methods[] = { /* method definition table */
 	{"BL_Acquire",bitlib_BL_Acquire, METH_VARARGS, bitlib_BL_Acquire_doc},
+	{"BL_AcquireInto",bitlib_BL_AcquireInto, METH_VARARGS, bitlib_BL_AcquireInto_doc},
 	{"BL_Close",bitlib_BL_Close, METH_VARARGS, bitlib_BL_Close_doc},
 	{"BL_Count",bitlib_BL_Count, METH_VARARGS, bitlib_BL_Count_doc},
 	{"BL_Coupling",bitlib_BL_Coupling, METH_VARARGS, bitlib_BL_Coupling_doc},
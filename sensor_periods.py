@@ -0,0 +1,75 @@
+import os
+import glob
+import time
+import sys
+import signal
+import RPi.GPIO as GPIO
+import w1therm
+
+os.system('modprobe w1-gpio')
+os.system('modprobe w1-therm')
+
+# Sensors on the bus, each sampled on its own period by w1therm.Scheduler
+DEVICES = w1therm.discover()
+SENSORS = sorted(DEVICES)
+print('Available sensors: {0}'.format(' '.join(SENSORS)))
+
+# LED PINs
+LED = 2
+
+#GPIO Setup
+GPIO.setmode(GPIO.BCM)
+GPIO.setwarnings(False)
+GPIO.setup(LED, GPIO.OUT)
+
+#Initilise LEDs
+GPIO.output(LED, 0)
+
+def set_sampling_time():
+    samplingTimes = {}
+    print('Time for sampling should be set in scaled of seconds')
+    print(16*'*')
+    for sensor in SENSORS:
+        samplingTimes[sensor] = float(input('Sampling time for sensor {0} :   '.format(sensor)))
+    print(16*'*')
+    return samplingTimes
+
+def sensor_file(files, sensor):
+    """ Log file of a sensor, created the first time it reports. """
+    if sensor not in files:
+        files[sensor] = open('{0}.txt'.format(sensor), 'w')
+        files[sensor].write('File created for sensor {0}\n'.format(sensor))
+    return files[sensor]
+
+def live_sampling(files, sensor, temp, due) :
+    sensor_file(files, sensor).write('{0}\n'.format(temp))
+    print('Sensor {0} is {1}'.format(sensor, temp))
+
+def missed_deadline(sensor, count):
+    print('Sensor {0} missed {1} sample(s)'.format(sensor, count))
+    
+def main():
+    sensorSamplingRate = set_sampling_time()
+    print(sensorSamplingRate)
+    
+    filesWrite = {}
+    poller = w1therm.Poller(DEVICES)
+    # Sensors found later use the shortest interval given
+    scheduler = w1therm.Scheduler(poller, min(list(sensorSamplingRate.values()) or [1.0]), sensorSamplingRate,
+                                  on_reading=lambda sensor, temp, due: live_sampling(filesWrite, sensor, temp, due),
+                                  on_missed=missed_deadline)
+        
+    try:
+        scheduler.run()
+        
+    except (KeyboardInterrupt, Exception) as e:
+        print(e)
+        GPIO.cleanup()
+        poller.close()
+        for sensor in filesWrite:
+            filesWrite[sensor].close()
+        print('Missed samples: {0}'.format(scheduler.missed))
+        print("Program successfully terminated")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+""" Disk-backed spool for publishes made while the uplink is down.
+
+configureOfflinePublishQueueing(-1) queues offline publishes in memory
+without bound: a long outage can run the Pi out of RAM, and a restart
+loses the lot. Spool keeps them on disk instead, in an append-only log
+of segment files, bounded to max_bytes: when full it evicts the oldest
+segment (DROP_OLDEST) or refuses new records (DROP_NEWEST).
+
+SpoolingPublisher puts it in front of an AWSIoTMQTTClient, with the SDK's
+own offline queue disabled. Publishes go straight out while the client is
+online and into the spool when it is offline or a publish fails. Once the
+connection is back the spool is replayed in order by a background thread
+at no more than rate messages/s, so a backfill doesn't starve live
+traffic of the link.
+
+Each record is crc32, then HEADER (length, time, qos, flags, topic
+length), then the topic and the payload. A record torn by a power cut is
+cut off when the spool is next opened. How far replay got is kept in a
+cursor file, so after a crash some records may be sent twice but none
+are skipped. """
+import os
+import struct
+import threading
+import time
+import zlib
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+CRC = struct.Struct("<I")
+HEADER = struct.Struct("<IdBBH") # payload length, time, qos, flags, topic length
+TEXT = 1 # flags: the payload was a str
+SEGMENT = "%012d.seg"
+CURSOR = "cursor"
+CURSOR_SAVE = 1.0 # seconds between cursor writes while replaying
+
+
+class Spool(object):
+    """ Bounded append-only log of (topic, payload, qos, time) records in
+    directory. append() adds at the tail; peek() returns the oldest record
+    not yet acknowledged and ack() moves past it. Thread safe. """
+
+    def __init__(self, directory, max_bytes=64 << 20, segment_bytes=1 << 20, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError("Unknown spool policy %r" % policy)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.appended = 0
+        self.acked = 0
+        self.evicted = 0 # records lost to eviction
+        self.refused = 0 # records not taken because the spool was full
+        self.corrupt = 0 # records lost to a corrupt finished segment
+        self.segments = sorted(int(name.split(".")[0]) for name in os.listdir(directory)
+                               if name.endswith(".seg"))
+        if not self.segments:
+            self.segments = [0]
+            open(self.path(0), "ab").close()
+        self.cursor = self.load_cursor()
+        for segment in [segment for segment in self.segments[:-1] if segment < self.cursor[0]]:
+            # Sent in full before a crash, removed before the cursor was saved
+            os.remove(self.path(segment))
+            self.segments.remove(segment)
+        self.repair_tail()
+        self.sizes = dict((segment, os.path.getsize(self.path(segment))) for segment in self.segments)
+        self.pending = sum(self.count_records(segment, self.cursor[1] if segment == self.cursor[0] else 0)
+                           for segment in self.segments)
+        self.writer = open(self.path(self.segments[-1]), "ab")
+        self.reader = None # (segment, open file)
+        self.saved_at = time.time()
+
+    def path(self, segment):
+        return os.path.join(self.directory, SEGMENT % segment)
+
+    def load_cursor(self):
+        """ (segment, offset) of the oldest unacknowledged record. """
+        try:
+            with open(os.path.join(self.directory, CURSOR)) as f:
+                segment, offset = [int(field) for field in f.read().split()]
+        except (IOError, OSError, ValueError):
+            return (self.segments[0], 0)
+        if segment < self.segments[0]:
+            return (self.segments[0], 0)
+        return (segment, offset)
+
+    def save_cursor(self):
+        path = os.path.join(self.directory, CURSOR)
+        with open(path + ".tmp", "w") as f:
+            f.write("%d %d\n" % self.cursor)
+        os.rename(path + ".tmp", path)
+        self.saved_at = time.time()
+
+    def read_record(self, f):
+        """ (topic, payload, qos, time) at f's position, None at the end or
+        at a torn or corrupt record. """
+        head = f.read(CRC.size + HEADER.size)
+        if len(head) < CRC.size + HEADER.size:
+            return None
+        crc, = CRC.unpack_from(head)
+        length, t, qos, flags, topic_length = HEADER.unpack_from(head, CRC.size)
+        body = f.read(topic_length + length)
+        if len(body) < topic_length + length or zlib.crc32(head[CRC.size:] + body) & 0xffffffff != crc:
+            return None
+        payload = body[topic_length:]
+        if flags & TEXT:
+            payload = payload.decode("utf-8")
+        return body[:topic_length].decode("utf-8"), payload, qos, t
+
+    def repair_tail(self):
+        """ Cut the last segment after its last whole record. """
+        path = self.path(self.segments[-1])
+        with open(path, "r+b") as f:
+            good = 0
+            while self.read_record(f) is not None:
+                good = f.tell()
+            f.truncate(good)
+
+    def count_records(self, segment, offset=0):
+        """ Records in a segment from offset on, skipping over the bodies. """
+        count = 0
+        with open(self.path(segment), "rb") as f:
+            f.seek(offset)
+            while True:
+                head = f.read(CRC.size + HEADER.size)
+                if len(head) < CRC.size + HEADER.size:
+                    return count
+                length, t, qos, flags, topic_length = HEADER.unpack_from(head, CRC.size)
+                f.seek(topic_length + length, 1)
+                count += 1
+
+    def size(self):
+        return sum(self.sizes.values())
+
+    def __len__(self):
+        return self.pending
+
+    def evict_oldest(self):
+        """ Drop the oldest segment and whatever in it was not sent yet. """
+        segment = self.segments[0]
+        if segment == self.segments[-1]:
+            self.roll()
+        lost = self.count_records(segment, self.cursor[1] if segment == self.cursor[0] else 0)
+        self.remove_segment(segment)
+        self.pending -= lost
+        self.evicted += lost
+
+    def remove_segment(self, segment):
+        if self.reader is not None and self.reader[0] == segment:
+            self.reader[1].close()
+            self.reader = None
+        os.remove(self.path(segment))
+        self.segments.remove(segment)
+        del self.sizes[segment]
+        if self.cursor[0] <= segment:
+            self.cursor = (self.segments[0], 0)
+
+    def roll(self):
+        self.writer.close()
+        segment = self.segments[-1] + 1
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.writer = open(self.path(segment), "ab")
+
+    def append(self, topic, payload, qos=1, timestamp=None):
+        """ Add a record. False if it was refused (spool full, DROP_NEWEST). """
+        flags = 0
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8")
+            flags |= TEXT
+        topic = topic.encode("utf-8")
+        body = HEADER.pack(len(payload), time.time() if timestamp is None else timestamp,
+                           qos, flags, len(topic)) + topic + payload
+        record = CRC.pack(zlib.crc32(body) & 0xffffffff) + body
+        with self.lock:
+            while self.size() + len(record) > self.max_bytes and self.pending:
+                if self.policy == DROP_NEWEST:
+                    self.refused += 1
+                    return False
+                self.evict_oldest()
+            if self.sizes[self.segments[-1]] >= self.segment_bytes:
+                self.roll()
+            self.writer.write(record)
+            self.writer.flush()
+            self.sizes[self.segments[-1]] += len(record)
+            self.pending += 1
+            self.appended += 1
+            return True
+
+    def peek(self):
+        """ (record, position) of the oldest unacknowledged record, record
+        being (topic, payload, qos, time), or None if there is none. """
+        with self.lock:
+            while self.pending:
+                segment, offset = self.cursor
+                if self.reader is None or self.reader[0] != segment:
+                    if self.reader is not None:
+                        self.reader[1].close()
+                    self.reader = (segment, open(self.path(segment), "rb"))
+                f = self.reader[1]
+                f.seek(offset)
+                record = self.read_record(f)
+                if record is not None:
+                    return record, (segment, f.tell())
+                if segment == self.segments[-1]:
+                    return None
+                # Past the end of a finished segment, or at a corrupt record in
+                # it: whatever was left unsent in it is lost
+                lost = self.count_records(segment, offset)
+                self.remove_segment(segment)
+                self.pending -= lost
+                self.corrupt += lost
+            return None
+
+    def ack(self, position):
+        """ Mark everything before position (from peek) as sent. """
+        with self.lock:
+            if position[0] not in self.sizes or position < self.cursor:
+                return # evicted meanwhile
+            self.cursor = position
+            self.pending -= 1
+            self.acked += 1
+            segment, offset = position
+            if offset >= self.sizes[segment] and segment != self.segments[-1]:
+                self.remove_segment(segment)
+            if time.time() - self.saved_at >= CURSOR_SAVE:
+                self.save_cursor()
+
+    def stats(self):
+        return {"pending": self.pending, "bytes": self.size(), "segments": len(self.segments),
+                "appended": self.appended, "acked": self.acked, "evicted": self.evicted,
+                "refused": self.refused, "corrupt": self.corrupt, "policy": self.policy}
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+            if self.reader is not None:
+                self.reader[1].close()
+                self.reader = None
+            self.save_cursor()
+
+
+class RateLimiter(object):
+    """ Token bucket: wait() returns once a token is available. """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def wait(self):
+        while True:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+class SpoolingPublisher(object):
+    """ publish(topic, payload, qos) like AWSIoTMQTTClient's, spooling what
+    can't be sent now. Configure the client with
+    configureOfflinePublishQueueing(0) so offline publishes fail here
+    instead of queueing in memory. Any exception or False from the
+    client's publish counts as a failure.
+
+    AWSIoTMQTTClient hands onOnline and onOffline to its connection in
+    connect(), so build this before connecting, with connected=False:
+    publishes are spooled until the first onOnline. """
+
+    def __init__(self, client, spool, rate=10.0, burst=5, retry=5.0, connected=True):
+        self.client = client
+        self.spool = spool
+        self.limiter = RateLimiter(rate, burst)
+        self.retry = retry # seconds to wait after a failed replay
+        self.cond = threading.Condition()
+        self.connected = connected
+        self.closed = False
+        self.sent = 0
+        self.spooled = 0
+        self.replayed = 0
+        # Chain the client's connection callbacks
+        self.client_online = getattr(client, "onOnline", None)
+        self.client_offline = getattr(client, "onOffline", None)
+        client.onOnline = self.online
+        client.onOffline = self.offline
+        self.thread = threading.Thread(target=self.replay_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def online(self):
+        with self.cond:
+            self.connected = True
+            self.cond.notify()
+        if self.client_online is not None:
+            self.client_online()
+
+    def offline(self):
+        with self.cond:
+            self.connected = False
+        if self.client_offline is not None:
+            self.client_offline()
+
+    def send(self, topic, payload, qos):
+        try:
+            return self.client.publish(topic, payload, qos) is not False
+        except Exception:
+            return False
+
+    def publish(self, topic, payload, qos=1):
+        """ True if sent now, False if spooled (or refused by a full spool). """
+        if self.connected and self.send(topic, payload, qos):
+            self.sent += 1
+            return True
+        self.defer(topic, payload, qos)
+        return False
+
+    def defer(self, topic, payload, qos=1):
+        """ Spool a publish for the replay thread without trying to send it.
+        False if a full spool refused it. """
+        if not self.spool.append(topic, payload, qos):
+            return False
+        self.spooled += 1
+        with self.cond:
+            self.cond.notify()
+        return True
+
+    def replay_loop(self):
+        while True:
+            with self.cond:
+                while not self.closed and not (self.connected and len(self.spool)):
+                    self.cond.wait(self.retry)
+                if self.closed:
+                    return
+            found = self.spool.peek()
+            if found is None:
+                continue
+            (topic, payload, qos, t), position = found
+            self.limiter.wait()
+            if self.send(topic, payload, qos):
+                self.spool.ack(position)
+                self.replayed += 1
+            else:
+                with self.cond:
+                    self.cond.wait(self.retry)
+
+    def stats(self):
+        stats = self.spool.stats()
+        stats.update(sent=self.sent, spooled=self.spooled, replayed=self.replayed)
+        return stats
+
+    def close(self):
+        """ Stop replaying; whatever is still spooled goes out next run. """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.spool.close()
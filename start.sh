@@ -18,4 +18,6 @@ fi
 
 # run pub/sub sample app using certificates downloaded in package
 printf "\nRunning pub/sub sample application...\n"
-python mysensors.py -e a26l68lei3sfjz.iot.us-east-2.amazonaws.com -r root-CA.crt -c dummyTempSensor.cert.pem -k dummyTempSensor.private.key
+# one uplink daemon holds the AWS IoT connection for every sensor script
+./uplinkStart.sh
+python mysensors.py
@@ -0,0 +1,267 @@
+""" Indexed reader for the exported temperature dumps.
+
+Two export formats are read, a chunk at a time:
+
+- chart dumps (Temp1Dump ...): one line of
+  [{"series":["Temp Sensor 1"],"data":[[{"x":ms,"y":temp},...]]}],
+  one data list per series, timestamped in ms since the epoch;
+- sensor dumps (RaspberryPiSensor): NDJSON lines of
+  {"col1":"<id> : <temp>","col2":...}. These carry no timestamps, so
+  readings are keyed by the row they were on.
+
+build_index() streams a dump into an index directory next to it (dump +
+'.idx'): a RECORD file of (time, value) per sensor, sorted by time, and a
+manifest.json naming the sensors and the source's size and mtime.
+open_dump() reuses the index while the dump is unchanged and rebuilds it
+otherwise. Queries go through memory maps of the RECORD files, and
+resample() walks its range in slices of SLICE records, so memory stays
+flat however long the export is. """
+import argparse
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+RECORD = np.dtype([('time', '<i8'), ('value', '<f4')])
+READ_SIZE = 1 << 16 # bytes read from a dump at a time
+FLUSH_EVERY = 4096 # readings buffered per sensor while indexing
+SLICE = 1 << 16 # records per step of resample()
+INDEX_VERSION = 1
+RESAMPLE = ('mean', 'min', 'max', 'last') # what resample() can take of each bin
+
+# Tokens of a chart dump: a series list, a reading, or the end of one series' data
+CHART_TOKEN = re.compile(r'"series"\s*:\s*(\[[^\]]*\])'
+                         r'|\{\s*"x"\s*:\s*(-?\d+)\s*,\s*"y"\s*:\s*(null|-?[0-9.eE+]+)\s*\}'
+                         r'|(\]\s*,\s*\[)')
+LONGEST_TOKEN = 4096 # unmatched bytes kept while looking for the next token
+
+
+def iter_chart_dump(path):
+    """ (series name, time in ms, temperature or None) for every reading of a chart dump. """
+    names = []
+    series = 0 # position in the current object's series list
+    first = 0 # position of the current object's first series in names
+    buffer = ''
+    with open(path) as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            buffer += chunk
+            end = 0
+            for match in CHART_TOKEN.finditer(buffer):
+                # A token running into the end of the buffer may be cut short
+                if chunk and match.end() == len(buffer):
+                    break
+                end = match.end()
+                listed, x, y, next_series = match.groups()
+                if listed is not None:
+                    first = len(names)
+                    names.extend(json.loads(listed))
+                    series = 0
+                elif next_series is not None:
+                    series += 1
+                elif first + series < len(names):
+                    yield names[first + series], int(x), None if y == 'null' else float(y)
+            buffer = buffer[end:]
+            if len(buffer) > LONGEST_TOKEN:
+                buffer = buffer[-LONGEST_TOKEN:]
+            if not chunk:
+                break
+
+def iter_sensor_dump(path):
+    """ (sensor id, row, temperature) for every reading of a sensor dump.
+    Lines that don't parse (the export has runs of NULs) are skipped. """
+    row = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip(b'\x00 \r\n')
+            if not line:
+                continue
+            try:
+                columns = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            for column in columns.values():
+                sensor, _, value = column.partition(' : ')
+                try:
+                    yield sensor.strip(), row, float(value)
+                except ValueError:
+                    continue
+            row += 1
+
+def dump_format(path):
+    """ 'chart' or 'sensor', from the first bytes of the dump. """
+    with open(path, 'rb') as f:
+        start = f.read(64).lstrip(b'\x00 \r\n')
+    return 'chart' if start.startswith(b'[') else 'sensor'
+
+
+def index_dir(path):
+    return path + '.idx'
+
+def build_index(path, directory=None):
+    """ Stream the dump at path into an index directory and return its manifest. """
+    directory = directory or index_dir(path)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    kind = dump_format(path)
+    readings = iter_chart_dump(path) if kind == 'chart' else iter_sensor_dump(path)
+    sensors = {} # name -> {'file', 'count', 'sorted', 'last'}
+    files = {}
+    pending = {}
+    for name, t, value in readings:
+        if name not in sensors:
+            sensors[name] = {'file': 'sensor%d.rec' % len(sensors), 'count': 0, 'sorted': True, 'last': None}
+            files[name] = open(os.path.join(directory, sensors[name]['file']), 'wb')
+            pending[name] = []
+        entry = sensors[name]
+        if entry['last'] is not None and t < entry['last']:
+            entry['sorted'] = False
+        entry['last'] = t
+        entry['count'] += 1
+        pending[name].append((t, np.nan if value is None else value))
+        if len(pending[name]) >= FLUSH_EVERY:
+            files[name].write(np.array(pending[name], dtype=RECORD).tobytes())
+            pending[name] = []
+    for name in sensors:
+        files[name].write(np.array(pending[name], dtype=RECORD).tobytes())
+        files[name].close()
+        entry = sensors[name]
+        records = np.memmap(os.path.join(directory, entry['file']), RECORD, 'r+') if entry['count'] else None
+        if records is not None and not entry['sorted']:
+            records.sort(order='time', kind='mergesort')
+            records.flush()
+        entry['start'] = int(records['time'][0]) if entry['count'] else None
+        entry['end'] = int(records['time'][-1]) if entry['count'] else None
+        del entry['sorted'], entry['last'], records
+    stat = os.stat(path)
+    manifest = {'version': INDEX_VERSION, 'source': os.path.abspath(path), 'size': stat.st_size,
+                'mtime': stat.st_mtime, 'format': kind, 'time': 'ms' if kind == 'chart' else 'row',
+                'sensors': sensors}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+def read_manifest(path, directory=None):
+    """ The index's manifest, or None if it is missing or older than the dump. """
+    try:
+        with open(os.path.join(directory or index_dir(path), 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    stat = os.stat(path)
+    if (manifest.get('version') != INDEX_VERSION or manifest['size'] != stat.st_size
+            or manifest['mtime'] != stat.st_mtime):
+        return None
+    return manifest
+
+def open_dump(path, directory=None):
+    """ TempDump for the dump at path, indexing it first if needed. """
+    directory = directory or index_dir(path)
+    manifest = read_manifest(path, directory) or build_index(path, directory)
+    return TempDump(directory, manifest)
+
+
+class TempDump(object):
+    """ Range queries over an index directory. Times are ms since the epoch
+    for chart dumps and rows for sensor dumps (see the time attribute). """
+
+    def __init__(self, directory, manifest=None):
+        if manifest is None:
+            with open(os.path.join(directory, 'manifest.json')) as f:
+                manifest = json.load(f)
+        self.directory = directory
+        self.manifest = manifest
+        self.time = manifest['time']
+        self.maps = {}
+
+    @property
+    def sensors(self):
+        return sorted(self.manifest['sensors'])
+
+    def records(self, sensor):
+        """ Memory mapped RECORD array of every reading of sensor. """
+        if sensor not in self.maps:
+            entry = self.manifest['sensors'][sensor]
+            if not entry['count']:
+                return np.zeros(0, RECORD)
+            self.maps[sensor] = np.memmap(os.path.join(self.directory, entry['file']), RECORD, 'r')
+        return self.maps[sensor]
+
+    def bounds(self, sensor, start=None, end=None):
+        """ (first, last) positions of the readings with start <= time < end. """
+        times = self.records(sensor)['time']
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side='left'))
+        return first, max(first, last)
+
+    def range(self, sensor, start=None, end=None):
+        """ (times, values) views of the readings with start <= time < end. """
+        first, last = self.bounds(sensor, start, end)
+        records = self.records(sensor)[first:last]
+        return records['time'], records['value']
+
+    def resample(self, sensor, step, start=None, end=None, how='mean'):
+        """ (bin start times, values) of the readings in bins of step, NaN
+        where a bin has none. how is 'mean', 'min', 'max' or 'last'. """
+        if how not in RESAMPLE:
+            raise ValueError('Unknown resample %r, not one of %s' % (how, ', '.join(RESAMPLE)))
+        entry = self.manifest['sensors'][sensor]
+        start = entry['start'] if start is None else start
+        end = entry['end'] + 1 if end is None else end
+        if start is None or end <= start:
+            return np.zeros(0, np.int64), np.zeros(0)
+        bins = -(-(end - start) // step)
+        if how == 'mean':
+            totals, counts = np.zeros(bins), np.zeros(bins)
+        else:
+            result = np.full(bins, np.nan)
+        first, last = self.bounds(sensor, start, end)
+        records = self.records(sensor)
+        for at in range(first, last, SLICE):
+            part = records[at:min(last, at + SLICE)]
+            keep = ~np.isnan(part['value'])
+            which = ((part['time'][keep] - start) // step).astype(np.intp)
+            values = part['value'][keep].astype(np.float64)
+            if how == 'mean':
+                totals += np.bincount(which, values, bins)
+                counts += np.bincount(which, minlength=bins)
+            elif how == 'last':
+                result[which] = values # times are sorted, so the last write wins
+            elif how == 'min':
+                np.fmin.at(result, which, values)
+            elif how == 'max':
+                np.fmax.at(result, which, values)
+        if how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = totals / counts
+        return start + np.arange(bins, dtype=np.int64) * step, result
+
+    def close(self):
+        self.maps = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index temperature dumps and print a resampled summary')
+    parser.add_argument('dumps', nargs='+', help='Temp*Dump chart exports or RaspberryPiSensor NDJSON')
+    parser.add_argument('--step', type=int, default=None,
+                        help='Bin width, in ms for chart dumps and rows for sensor dumps')
+    parser.add_argument('--rebuild', action='store_true', help='Index again even if the index is current')
+    args = parser.parse_args()
+    for path in args.dumps:
+        if args.rebuild:
+            build_index(path)
+        dump = open_dump(path)
+        print('%s: %s dump, time in %s' % (path, dump.manifest['format'], dump.time))
+        for sensor in dump.sensors:
+            entry = dump.manifest['sensors'][sensor]
+            print('  %-16s %6d readings, %s to %s' % (sensor, entry['count'], entry['start'], entry['end']))
+            if args.step:
+                starts, means = dump.resample(sensor, args.step)
+                print('    ' + ' '.join('%.2f' % value for value in means))
+        dump.close()
+
+if __name__ == '__main__':
+    main()
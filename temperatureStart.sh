@@ -17,4 +17,6 @@ if [ ! -d ./aws-iot-device-sdk-python ]; then
 fi
 
 # run pub/sub sample app using certificates downloaded in package
-python mysensors.py -e a26l68lei3sfjz.iot.us-east-2.amazonaws.com -r root-CA.crt -c dummyTempSensor.cert.pem -k dummyTempSensor.private.key
+# one uplink daemon holds the AWS IoT connection for every sensor script
+./uplinkStart.sh
+python mysensors.py
@@ -0,0 +1,519 @@
+'''
+One AWS IoT connection shared by every sensor script on the Pi.
+
+Each sensor script used to set up its own AWSIoTMQTTClient, paying for its
+own TLS handshake, keepalive and memory. Run this daemon once instead
+(uplinkStart.sh starts it unless one is already running):
+
+    python uplink.py -e <endpoint> -r root-CA.crt -c <cert> -k <key>
+
+It listens on its socket before connecting to AWS IoT and refuses to
+start if another daemon already answers there.
+
+It owns the broker connection and the offline spool (see spool.py).
+Sensor scripts hand it messages over a Unix domain socket with
+UplinkClient, whose publish(topic, payload, qos) stands in for the
+client's. Messages wait in one priority queue, so temperatures go out
+ahead of bulk acoustic data. QoS and priority come from the sender or,
+if it leaves them out, from TOPICS.
+
+A QoS 1 publish waits for its PUBACK, so one at a time they are capped at
+one message per round trip to the broker. The daemon sends them through
+InflightWindow instead, which keeps up to --window of them waiting for
+their PUBACKs at once. Raw streams are sent at QoS 0 and don't wait at
+all. See bench_uplink.py for what each policy is worth.
+
+Each message on the socket is MESSAGE (payload length, topic length,
+qos, priority, flags) followed by the topic and the payload.
+'''
+import argparse
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from spool import Spool, SpoolingPublisher
+
+SOCKET_PATH = '/tmp/uplink.sock'
+MESSAGE = struct.Struct('<IHBBB') # payload length, topic length, qos, priority, flags
+DEFAULT = 255 # qos or priority left to the daemon
+TEXT = 1 # flags: the payload was a str
+# topic -> (qos, priority), lower priorities are sent first
+TOPICS = {'/TemperatureSensors': (1, 0), '/AcousticSensor/stats': (1, 2), '/AcousticSensor/spectrum': (1, 4),
+          '/AcousticSensor/event': (1, 3), '/AcousticSensor': (0, 5)}
+OTHER_TOPICS = (1, 3)
+LATE_ACKS = 10 # expired message ids are remembered for this many ack timeouts
+EXPIRE_EVERY = 1.0 # seconds between checks for overdue PUBACKs
+
+
+def read_exactly(conn, count):
+    """ count bytes from a socket, None if it closed first. """
+    data = bytearray()
+    while len(data) < count:
+        chunk = conn.recv(min(count - len(data), 1 << 16))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def daemon_running(path=SOCKET_PATH):
+    """ True if an uplink daemon is accepting connections at path. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+class UplinkClient(object):
+    """ Sensor side of the daemon's socket. While the daemon can't be
+    reached (starting up or restarting) messages wait in a backlog of up
+    to max_backlog, the oldest dropped beyond that, and go out in order
+    once it is back; reconnection is tried at most every retry seconds.
+    publish() returns True if the message went to the daemon now. Thread
+    safe. """
+
+    def __init__(self, path=SOCKET_PATH, retry=5.0, max_backlog=1000):
+        self.path = path
+        self.retry = retry
+        self.lock = threading.Lock()
+        self.sock = None
+        self.tried_at = 0
+        self.backlog = deque(maxlen=max_backlog)
+        self.sent = 0
+        self.dropped = 0
+
+    def connect(self, force=False):
+        if self.sock is not None:
+            return True
+        if not force and time.time() - self.tried_at < self.retry:
+            return False
+        self.tried_at = time.time()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except (IOError, OSError) as e:
+            print('Uplink daemon not reachable at {0} ({1}), {2} messages waiting'.format(
+                self.path, e, len(self.backlog)))
+            sock.close()
+            return False
+        self.sock = sock
+        return True
+
+    def send_backlog(self, force=False):
+        """ Send the waiting messages in order. Call holding lock. """
+        if not self.connect(force):
+            return False
+        while self.backlog:
+            try:
+                self.sock.sendall(self.backlog[0])
+            except (IOError, OSError):
+                self.sock.close()
+                self.sock = None
+                return False
+            self.backlog.popleft()
+            self.sent += 1
+        return True
+
+    def publish(self, topic, payload, qos=None, priority=None):
+        flags = 0
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+            flags = TEXT
+        topic = topic.encode('utf-8')
+        message = MESSAGE.pack(len(payload), len(topic), DEFAULT if qos is None else qos,
+                               DEFAULT if priority is None else priority, flags) + topic + payload
+        with self.lock:
+            if len(self.backlog) == self.backlog.maxlen:
+                self.dropped += 1
+            self.backlog.append(message)
+            return self.send_backlog()
+
+    def close(self):
+        """ Make a last attempt at the backlog and hang up. """
+        with self.lock:
+            self.send_backlog(force=True)
+            self.dropped += len(self.backlog)
+            self.backlog.clear()
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+
+class InflightWindow(object):
+    """ Client wrapper that sends QoS 1 publishes with publishAsync, with
+    at most window of them waiting for a PUBACK at once; QoS 0 publishes
+    go straight through. A publish that finds the window full waits for
+    a slot. A PUBACK not seen within timeout frees its slot and the
+    message is handed to on_expired(topic, payload, qos), e.g. a
+    SpoolingPublisher's defer, as the publish has in effect failed; a
+    PUBACK that turns up for it later is ignored, so a message that reuses
+    its id is not taken as acked, unless it comes while a publish is
+    being sent and may be that publish's own. expire_overdue() should be called
+    regularly so overdue messages are handed on when traffic is light. """
+
+    def __init__(self, client, window=10, timeout=30.0, on_expired=None):
+        self.client = client
+        self.window = window
+        self.timeout = timeout
+        self.on_expired = on_expired
+        self.cond = threading.Condition()
+        self.inflight = {} # message id -> (time sent, topic, payload)
+        self.early = set() # PUBACKs that arrived before publishAsync returned
+        self.late = {} # message id -> when it expired, so its PUBACK is ignored if it still comes
+        self.reserved = 0 # slots taken by publishes being sent
+        self.acked = 0
+        self.expired = 0
+        self.high_water = 0
+
+    # SpoolingPublisher hooks the client's connection callbacks
+    @property
+    def onOnline(self):
+        return getattr(self.client, 'onOnline', None)
+
+    @onOnline.setter
+    def onOnline(self, callback):
+        self.client.onOnline = callback
+
+    @property
+    def onOffline(self):
+        return getattr(self.client, 'onOffline', None)
+
+    @onOffline.setter
+    def onOffline(self, callback):
+        self.client.onOffline = callback
+
+    def puback(self, mid):
+        with self.cond:
+            if self.inflight.pop(mid, None) is not None:
+                self.acked += 1
+                self.cond.notify()
+            elif self.reserved:
+                # A publishAsync still in progress may have been handed this
+                # id, even one still in late, and not returned it yet
+                self.early.add(mid)
+
+    def expire(self):
+        """ Messages whose PUBACK is overdue, dropped from the window. Call
+        holding cond. """
+        now = time.time()
+        expired = []
+        for mid, (sent, topic, payload) in list(self.inflight.items()):
+            if now - sent > self.timeout:
+                del self.inflight[mid]
+                self.late[mid] = now
+                expired.append((topic, payload))
+        for mid, at in list(self.late.items()):
+            if now - at > LATE_ACKS * self.timeout:
+                del self.late[mid]
+        self.expired += len(expired)
+        return expired
+
+    def expire_overdue(self):
+        """ Hand overdue messages to on_expired. Called on a timer so they
+        are not left waiting for a full window. """
+        with self.cond:
+            expired = self.expire()
+            if expired:
+                self.cond.notify_all()
+        if self.on_expired is not None:
+            for topic, payload in expired:
+                self.on_expired(topic, payload, 1)
+
+    def publish(self, topic, payload, qos):
+        if qos == 0:
+            return self.client.publish(topic, payload, 0)
+        expired = []
+        with self.cond:
+            while len(self.inflight) + self.reserved >= self.window:
+                expired += self.expire()
+                if len(self.inflight) + self.reserved < self.window:
+                    break
+                self.cond.wait(min(self.timeout, 1.0))
+            self.reserved += 1
+        if self.on_expired is not None:
+            for expired_topic, expired_payload in expired:
+                self.on_expired(expired_topic, expired_payload, 1)
+        try:
+            mid = self.client.publishAsync(topic, payload, 1, ackCallback=self.puback)
+        except Exception:
+            with self.cond:
+                self.reserved -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.reserved -= 1
+            # The id is live again, a PUBACK for it is this message's
+            self.late.pop(mid, None)
+            if mid in self.early:
+                self.early.discard(mid)
+                self.acked += 1
+            else:
+                self.inflight[mid] = (time.time(), topic, payload)
+            if not self.reserved:
+                self.early.clear() # none of these belong to a publish any more
+            self.high_water = max(self.high_water, len(self.inflight))
+        return True
+
+    def drain(self, timeout=None):
+        """ Wait for the PUBACKs still due, up to timeout (default the
+        ack timeout). Those that don't come go to on_expired. """
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        with self.cond:
+            while self.inflight and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            now = time.time()
+            for mid in self.inflight:
+                sent, topic, payload = self.inflight[mid]
+                self.inflight[mid] = (now - self.timeout - 1, topic, payload)
+            expired = self.expire()
+        if self.on_expired is not None:
+            for topic, payload in expired:
+                self.on_expired(topic, payload, 1)
+
+    def stats(self):
+        with self.cond:
+            return {'inflight': len(self.inflight), 'acked': self.acked,
+                    'expired': self.expired, 'window': self.window, 'highWater': self.high_water}
+
+
+class UplinkServer(object):
+    """ Takes messages from any number of UplinkClients and publishes them
+    through publisher (a SpoolingPublisher), most urgent first. When more
+    than max_queue are waiting, new ones go straight to the spool. """
+
+    def __init__(self, publisher, path=SOCKET_PATH, max_queue=1000, topics=TOPICS, window=None):
+        self.publisher = publisher
+        self.window = window # InflightWindow whose overdue PUBACKs the send loop checks for
+        self.path = path
+        self.topics = topics
+        self.queue = queue.PriorityQueue(max_queue)
+        self.seq = 0 # keeps messages of one priority in arrival order
+        self.seq_lock = threading.Lock()
+        self.received = 0
+        self.overflowed = 0
+        self.stopping = False
+        self.listener = None
+        self.threads = []
+
+    def policy(self, topic, qos, priority):
+        default_qos, default_priority = self.topics.get(topic, OTHER_TOPICS)
+        return (default_qos if qos == DEFAULT else qos,
+                default_priority if priority == DEFAULT else priority)
+
+    def start(self):
+        """ Listen on path. Raises RuntimeError if another daemon is live
+        there; a socket file left by one that died is replaced. """
+        if daemon_running(self.path):
+            raise RuntimeError('Another uplink daemon is already listening on {0}'.format(self.path))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(8)
+        for target in (self.accept_loop, self.send_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def accept_loop(self):
+        while not self.stopping:
+            try:
+                conn, address = self.listener.accept()
+            except (IOError, OSError):
+                break
+            thread = threading.Thread(target=self.receive_loop, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def receive_loop(self, conn):
+        """ Queue every message from one sensor script until it hangs up. """
+        try:
+            while True:
+                head = read_exactly(conn, MESSAGE.size)
+                if head is None:
+                    break
+                length, topic_length, qos, priority, flags = MESSAGE.unpack(head)
+                body = read_exactly(conn, topic_length + length)
+                if body is None:
+                    break
+                topic = body[:topic_length].decode('utf-8')
+                payload = body[topic_length:]
+                if flags & TEXT:
+                    payload = payload.decode('utf-8')
+                qos, priority = self.policy(topic, qos, priority)
+                self.received += 1
+                with self.seq_lock:
+                    self.seq += 1
+                    item = (priority, self.seq, topic, payload, qos)
+                try:
+                    self.queue.put_nowait(item)
+                except queue.Full:
+                    self.overflowed += 1
+                    self.publisher.defer(topic, payload, qos)
+        finally:
+            conn.close()
+
+    def send_loop(self):
+        checked_at = time.time()
+        while True:
+            if self.window is not None and time.time() - checked_at >= EXPIRE_EVERY:
+                self.window.expire_overdue()
+                checked_at = time.time()
+            try:
+                priority, seq, topic, payload, qos = self.queue.get(timeout=EXPIRE_EVERY)
+            except queue.Empty:
+                continue
+            if topic is None:
+                return
+            self.publisher.publish(topic, payload, qos)
+
+    def stats(self):
+        stats = self.publisher.stats()
+        stats.update(received=self.received, queued=self.queue.qsize(), overflowed=self.overflowed)
+        return stats
+
+    def stop(self):
+        """ Send what is queued (or spool it if offline) and close. """
+        self.stopping = True
+        self.listener.close()
+        self.queue.put((DEFAULT + 1, 0, None, None, None))
+        self.threads[-1].join()
+        os.remove(self.path)
+
+####################################################
+
+def terminate(signum, frame):
+    # Stop on kill as on Ctrl-C, sending or spooling what is queued
+    raise KeyboardInterrupt
+
+# Custom MQTT message callback
+def customCallback(client, userdata, message):
+    print("Received a new message: ")
+    print(message.payload)
+    print("from topic: ")
+    print(message.topic)
+    print("--------------\n\n")
+
+def main():
+    # Read in command-line parameters
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--endpoint", action="store", dest="host", help="Your AWS IoT custom endpoint")
+    parser.add_argument("-r", "--rootCA", action="store", dest="rootCAPath", help="Root CA file path")
+    parser.add_argument("-c", "--cert", action="store", dest="certificatePath", help="Certificate file path")
+    parser.add_argument("-k", "--key", action="store", dest="privateKeyPath", help="Private key file path")
+    parser.add_argument("-w", "--websocket", action="store_true", dest="useWebsocket", default=False,
+                        help="Use MQTT over WebSocket")
+    parser.add_argument("-id", "--clientId", action="store", dest="clientId", default="basicPubSub",
+                        help="Targeted client id")
+    parser.add_argument("-t", "--topic", action="store", dest="topic", default="sdk/test/Python", help="Targeted topic")
+    parser.add_argument("-s", "--socket", action="store", dest="socketPath", default=SOCKET_PATH,
+                        help="Unix socket the sensor scripts publish through")
+    parser.add_argument("--spool", action="store", dest="spoolDir", default="spool",
+                        help="Directory for publishes made while offline")
+    parser.add_argument("--spool-bytes", action="store", dest="spoolBytes", type=int, default=256 << 20,
+                        help="Spool size limit, the oldest publishes are dropped beyond it")
+    parser.add_argument("--spool-rate", action="store", dest="spoolRate", type=float, default=5.0,
+                        help="Spooled publishes replayed per second once back online")
+    parser.add_argument("--window", action="store", dest="window", type=int, default=10,
+                        help="QoS 1 publishes allowed to wait for their PUBACK at once")
+    parser.add_argument("--ack-timeout", action="store", dest="ackTimeout", type=float, default=30.0,
+                        help="Seconds to wait for a PUBACK before spooling the publish again")
+    parser.add_argument("--check", action="store_true", dest="check", default=False,
+                        help="Exit 0 if a daemon is already listening on the socket, 1 if not")
+
+    args = parser.parse_args()
+    if args.check:
+        return 0 if daemon_running(args.socketPath) else 1
+    if not args.host or not args.rootCAPath:
+        parser.error("-e/--endpoint and -r/--rootCA are required.")
+    from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+    host = args.host
+    rootCAPath = args.rootCAPath
+    certificatePath = args.certificatePath
+    privateKeyPath = args.privateKeyPath
+    useWebsocket = args.useWebsocket
+    clientId = args.clientId
+    topic = args.topic
+
+    if args.useWebsocket and args.certificatePath and args.privateKeyPath:
+        parser.error("X.509 cert authentication and WebSocket are mutual exclusive. Please pick one.")
+        exit(2)
+
+    if not args.useWebsocket and (not args.certificatePath or not args.privateKeyPath):
+        parser.error("Missing credentials for authentication.")
+        exit(2)
+
+    # Configure logging
+    logger = logging.getLogger("AWSIoTPythonSDK.core")
+    logger.setLevel(logging.DEBUG)
+
+    # Init AWSIoTMQTTClient
+    myAWSIoTMQTTClient = None
+    if useWebsocket:
+        myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId, useWebsocket=True)
+        myAWSIoTMQTTClient.configureEndpoint(host, 443)
+        myAWSIoTMQTTClient.configureCredentials(rootCAPath)
+    else:
+        myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
+        myAWSIoTMQTTClient.configureEndpoint(host, 8883)
+        myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
+
+    # AWSIoTMQTTClient connection configuration
+    myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
+    myAWSIoTMQTTClient.configureOfflinePublishQueueing(0)  # Offline publishes go to the disk spool instead
+    myAWSIoTMQTTClient.configureDrainingFrequency(10)  # Draining: 10 Hz
+    myAWSIoTMQTTClient.configureConnectDisconnectTimeout(300)  # 5 mins
+    myAWSIoTMQTTClient.configureMQTTOperationTimeout(120)  # 2 mins
+
+    # The connection callbacks must be in place before connect() takes them
+    window = InflightWindow(myAWSIoTMQTTClient, args.window, args.ackTimeout)
+    publisher = SpoolingPublisher(window, Spool(args.spoolDir, args.spoolBytes), args.spoolRate, connected=False)
+    window.on_expired = publisher.defer
+
+    # Listen before connecting, which can take minutes; until then messages are spooled
+    server = UplinkServer(publisher, args.socketPath, window=window)
+    try:
+        server.start()
+    except RuntimeError as e:
+        print(e)
+        publisher.close()
+        return 1
+    signal.signal(signal.SIGTERM, terminate)
+    print("Uplink listening on {0}".format(args.socketPath))
+    try:
+        # Connect and subscribe to AWS IoT
+        myAWSIoTMQTTClient.connect()
+        myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
+        while True:
+            time.sleep(60)
+            print("Uplink: {received} received, {sent} sent, {spooled} spooled, {replayed} replayed, "
+                  "{pending} pending, {overflowed} overflowed".format(**server.stats()))
+            print("QoS 1 window: {acked} acked, {expired} expired, {inflight} in flight, "
+                  "high water {highWater} of {window}".format(**window.stats()))
+    except (KeyboardInterrupt, Exception) as e:
+        print(e)
+    server.stop()
+    # Unacknowledged publishes go back to the spool for next time
+    window.drain(5)
+    publisher.close()
+    myAWSIoTMQTTClient.disconnect()
+    print("Uplink stopped")
+
+if __name__ == '__main__':
+    sys.exit(main())
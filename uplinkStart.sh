@@ -0,0 +1,30 @@
+# Start the uplink daemon that holds the one AWS IoT connection, unless
+# one is already running. It is shared by every sensor script, so it is
+# left running when they stop: kill it with "pkill -f uplink.py".
+#
+# Every sensor's messages go out under the daemon's one identity, whichever
+# script starts it first. That is the dummyTempSensor thing unless
+# UPLINK_CERT, UPLINK_KEY and UPLINK_CLIENT_ID say otherwise, and its
+# policy must allow iot:Connect for the client id and iot:Publish on
+# /TemperatureSensors and /AcousticSensor, /AcousticSensor/stats,
+# /AcousticSensor/spectrum and /AcousticSensor/event. To publish as the
+# acoustic sensor's own thing instead, set
+#   UPLINK_CERT=AcousticSensor/0db9811d7e-certificate.pem.crt
+#   UPLINK_KEY=AcousticSensor/0db9811d7e-private.pem.key
+cd "$(dirname "$0")"
+
+UPLINK_CERT=${UPLINK_CERT:-dummyTempSensor.cert.pem}
+UPLINK_KEY=${UPLINK_KEY:-dummyTempSensor.private.key}
+UPLINK_CLIENT_ID=${UPLINK_CLIENT_ID:-basicPubSub}
+
+if python uplink.py --check; then
+  printf "\nUplink daemon already running\n"
+else
+  printf "\nStarting the uplink daemon as %s (%s)...\n" "$UPLINK_CLIENT_ID" "$UPLINK_CERT"
+  nohup python uplink.py -e a26l68lei3sfjz.iot.us-east-2.amazonaws.com -r root-CA.crt -c "$UPLINK_CERT" -k "$UPLINK_KEY" -id "$UPLINK_CLIENT_ID" >> uplink.log 2>&1 &
+  # It listens before connecting upstream, so this only waits for the socket
+  for i in 1 2 3 4 5 6 7 8 9 10; do
+    python uplink.py --check && break
+    sleep 1
+  done
+fi
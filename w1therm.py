@@ -0,0 +1,356 @@
+""" DS18B20 temperature sensors through the Linux w1-therm driver.
+
+Reading a sensor's w1_slave file blocks for a whole conversion (750 ms at
+the default 12 bit resolution), so sensors read one after the other cost
+the sum of their conversion times per cycle. Poller reads every sensor in
+its own thread instead: a cycle then takes as long as the slowest sensor,
+and a read that hangs is given up on after a timeout.
+
+Where the kernel offers it, a bulk read goes one better: writing trigger
+to the bus master's therm_bulk_read starts a conversion on every sensor
+at once, after which each sensor's reading comes back without another
+conversion. A sweep of the whole bus then costs one conversion time.
+
+The conversion time itself follows the resolution, which w1-therm lets
+us set per sensor: 9 bit (0.5 C) converts in 94 ms, 8 times faster than
+the power-on 12 bit (0.0625 C). Poller waits and times out by the
+resolutions actually in use. """
+import glob
+import heapq
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+BASE_DIR = '/sys/bus/w1/devices/'
+CONVERSION_TIMES = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75} # seconds by resolution in bits
+DEFAULT_RESOLUTION = 12 # power-on resolution
+READ_MARGIN = 1.25 # seconds a read may take beyond its conversion before it is given up on
+BULK_POLL = 0.01 # seconds between checks of a bulk conversion
+
+
+def sensor_id(device):
+    """ Short name of a sensor, the serial number after the zero padding. """
+    return os.path.basename(device.rstrip('/')).split('00000')[-1]
+
+def discover(base_dir=BASE_DIR):
+    """ {sensor id: device directory} for every DS18B20 on the bus. """
+    return dict((sensor_id(name), name) for name in sorted(glob.glob(base_dir + '28*')))
+
+def bulk_read_files(base_dir=BASE_DIR):
+    """ therm_bulk_read of every bus master, empty if the kernel has none. """
+    return sorted(glob.glob(base_dir + 'w1_bus_master*/therm_bulk_read'))
+
+def conversion_time(resolution):
+    return CONVERSION_TIMES[resolution]
+
+def get_resolution(device):
+    """ Resolution in bits, the power-on default if the kernel can't tell. """
+    try:
+        with open(os.path.join(device, 'resolution'), 'r') as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return DEFAULT_RESOLUTION
+
+def set_resolution(device, resolution):
+    """ Set the resolution (9 to 12 bits, needs root) and return the one
+    the sensor reports afterwards. """
+    if resolution not in CONVERSION_TIMES:
+        raise ValueError('Resolution must be 9 to 12 bits, not {0}'.format(resolution))
+    with open(os.path.join(device, 'resolution'), 'w') as f:
+        f.write('{0}\n'.format(resolution))
+    return get_resolution(device)
+
+def parse_w1_slave(lines):
+    """ Temperature in C from the two lines of w1_slave, None if the CRC failed. """
+    if len(lines) < 2 or not lines[0].strip().endswith('YES'):
+        return None
+    equals_pos = lines[1].find('t=')
+    if equals_pos == -1:
+        return None
+    return float(lines[1][equals_pos+2:]) / 1000.0
+
+def read_temp(device):
+    """ Start a conversion on one sensor and wait for its temperature. """
+    with open(os.path.join(device, 'w1_slave'), 'r') as f:
+        return parse_w1_slave(f.readlines())
+
+
+class Poller(object):
+    """ Reads a set of sensors concurrently.
+
+    devices maps sensor ids to device directories (see discover). poll()
+    returns {sensor id: temperature}, with None for a sensor whose read
+    failed or took longer than timeout. A timed out read keeps its thread
+    until the kernel returns, and that sensor is skipped until it does, so
+    a hung sensor costs one thread rather than one more every cycle.
+
+    bulk=None uses a bulk conversion when the kernel supports it, False
+    never does. If triggering ever fails the poller goes back to reading
+    each sensor on its own.
+
+    resolutions maps sensor ids to the bits to set them to; others keep
+    their current resolution. timeout=None allows each poll the longest
+    conversion it waits for plus READ_MARGIN. """
+
+    def __init__(self, devices, timeout=None, bulk=None, base_dir=BASE_DIR, resolutions=None):
+        self.devices = {}
+        self.timeout = timeout
+        self.bulk_files = bulk_read_files(base_dir) if bulk is not False else []
+        self.wanted_resolutions = dict(resolutions or {})
+        self.resolutions = {}
+        self.executor = None
+        self.max_workers = 0
+        self.pending = {} # sensor id -> read still running from an earlier poll
+        self.timeouts = {}
+        self.errors = {}
+        for sensor, device in devices.items():
+            self.add(sensor, device)
+
+    def add(self, sensor, device):
+        """ Start reading a sensor, at the resolution asked for if any. """
+        self.devices[sensor] = device
+        self.timeouts.setdefault(sensor, 0)
+        self.errors.setdefault(sensor, 0)
+        wanted = self.wanted_resolutions.get(sensor)
+        self.resolutions[sensor] = get_resolution(device)
+        if wanted is not None:
+            try:
+                self.resolutions[sensor] = set_resolution(device, wanted)
+            except (IOError, OSError) as e:
+                print('Cannot set sensor {0} to {1} bits ({2})'.format(sensor, wanted, e))
+        if self.max_workers < len(self.devices):
+            # A thread per sensor; reads already running finish in the old pool
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.max_workers = max(4, 2 * len(self.devices))
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def remove(self, sensor):
+        """ Stop reading a sensor that has left the bus. """
+        self.devices.pop(sensor, None)
+        self.resolutions.pop(sensor, None)
+        self.pending.pop(sensor, None)
+
+    def sensors(self):
+        return sorted(self.devices)
+
+    def bulk(self):
+        return bool(self.bulk_files)
+
+    def conversion_time(self, sensors=None):
+        """ Seconds until all of sensors (default all) have a reading, the
+        shortest sensible interval between polls of them. A bulk
+        conversion runs on every sensor, so waits for the slowest. """
+        if self.bulk_files or sensors is None:
+            sensors = self.devices
+        return max([conversion_time(self.resolutions[sensor]) for sensor in sensors] or [0])
+
+    def read_timeout(self, sensors=None):
+        if self.timeout is not None:
+            return self.timeout
+        return self.conversion_time(sensors) + READ_MARGIN
+
+    def trigger(self):
+        """ Start a conversion on every sensor and wait for it to finish.
+        False if bulk reads are not (or no longer) available. """
+        try:
+            for path in self.bulk_files:
+                with open(path, 'w') as f:
+                    f.write('trigger\n')
+        except (IOError, OSError) as e:
+            print('Bulk read unavailable ({0}), reading sensors one at a time'.format(e))
+            self.bulk_files = []
+            return False
+        time.sleep(self.conversion_time())
+        deadline = time.time() + self.read_timeout()
+        for path in self.bulk_files:
+            # -1 while a conversion is running, 1 once it is done, 0 if none was pending
+            while time.time() < deadline:
+                with open(path, 'r') as f:
+                    if f.read().strip() != '-1':
+                        break
+                time.sleep(BULK_POLL)
+        return True
+
+    def submit(self, sensor):
+        """ Start a read unless the last one is still running. """
+        future = self.pending.get(sensor)
+        if future is None or future.done():
+            future = self.executor.submit(read_temp, self.devices[sensor])
+            self.pending[sensor] = future
+            return future
+        return None
+
+    def collect(self, sensor, future):
+        """ Result of a finished read, None (and counted) if it failed. """
+        try:
+            temp = future.result(0)
+        except Exception:
+            self.errors[sensor] += 1
+            return None
+        if temp is None:
+            self.errors[sensor] += 1
+        return temp
+
+    def poll(self, sensors=None):
+        sensors = self.sensors() if sensors is None else sensors
+        if self.bulk_files:
+            # The reads below return the converted values straight away
+            self.trigger()
+        futures = dict((sensor, self.submit(sensor)) for sensor in sensors)
+        wait([future for future in futures.values() if future is not None], self.read_timeout(sensors))
+        temps = {}
+        for sensor, future in futures.items():
+            if future is None or not future.done():
+                self.timeouts[sensor] += 1
+                temps[sensor] = None
+            else:
+                temps[sensor] = self.collect(sensor, future)
+        return temps
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+class AdaptiveRate(object):
+    """ Per-sensor sampling intervals that follow how fast each sensor moves.
+
+    The interval aims for a change of about step C between samples, from
+    a smoothed estimate of each sensor's rate of change, kept within
+    min_interval and max_interval. It shrinks at once when a sensor starts
+    moving but stretches by at most a factor of stretch per sample, so a
+    single quiet sample doesn't slow a sensor that is still changing. The
+    interval is printed whenever it moves by more than a quarter. """
+
+    def __init__(self, min_interval, max_interval, step=0.125, stretch=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.step = step
+        self.stretch = stretch
+        self.last = {} # sensor id -> (temperature, time)
+        self.slope = {} # sensor id -> smoothed C/s
+        self.intervals = {}
+        self.logged = {}
+
+    def update(self, sensor, value, timestamp):
+        """ The interval until a sensor's next sample, given its latest. """
+        interval = self.intervals.get(sensor, self.min_interval)
+        if value is None:
+            return interval
+        if sensor in self.last and timestamp > self.last[sensor][1]:
+            last_value, last_time = self.last[sensor]
+            slope = abs(value - last_value) / (timestamp - last_time)
+            slope = self.slope[sensor] = 0.5 * slope + 0.5 * self.slope.get(sensor, slope)
+            target = self.step / slope if slope > 0 else self.max_interval
+            interval = min(target, interval * self.stretch)
+            interval = min(max(interval, self.min_interval), self.max_interval)
+        self.last[sensor] = (value, timestamp)
+        self.intervals[sensor] = interval
+        logged = self.logged.get(sensor)
+        if logged is None or not 0.8 <= interval / logged <= 1.25:
+            print('Sensor {0}: sampling every {1:.2f} s ({2:.3f} Hz)'.format(sensor, interval, 1.0 / interval))
+            self.logged[sensor] = interval
+        return interval
+
+
+class Scheduler(object):
+    """ Polls each sensor on its own period, in one process.
+
+    Deadlines are kept in a heap of (due time, sensor) and advance by the
+    period from the previous deadline, not from when the read finished,
+    so periods don't drift. Sensors due together are read in one poll.
+    A sensor that falls more than a period behind skips the samples it
+    missed, reported through on_missed(sensor, count), instead of
+    catching up in a burst.
+
+    intervals maps sensor ids to seconds, others use interval; no sensor
+    is polled faster than it converts. The bus is searched again every
+    rediscover seconds, so sensors can come and go. on_reading(sensor,
+    temperature, due) gets every result. With adaptive (an AdaptiveRate)
+    each reading sets that sensor's next interval instead. """
+
+    def __init__(self, poller, interval, intervals=None, on_reading=None, on_missed=None,
+                 base_dir=BASE_DIR, rediscover=30.0, adaptive=None):
+        self.poller = poller
+        self.interval = interval
+        self.intervals = dict(intervals or {})
+        self.adaptive = adaptive
+        self.on_reading = on_reading
+        self.on_missed = on_missed
+        self.base_dir = base_dir
+        self.rediscover = rediscover
+        self.heap = []
+        self.due = {} # sensor id -> its live deadline, older heap entries are stale
+        self.missed = {}
+        self.stopping = False
+
+    def period(self, sensor):
+        return max(self.intervals.get(sensor, self.interval), self.poller.conversion_time([sensor]))
+
+    def schedule(self, sensor, due):
+        self.due[sensor] = due
+        heapq.heappush(self.heap, (due, sensor))
+
+    def discover(self, now):
+        """ Add sensors that appeared on the bus, drop those that left. """
+        found = discover(self.base_dir)
+        for sensor in sorted(set(found) - set(self.poller.devices)):
+            print('Sensor {0} found'.format(sensor))
+            self.poller.add(sensor, found[sensor])
+            self.missed.setdefault(sensor, 0)
+            self.schedule(sensor, now)
+        for sensor in sorted(set(self.poller.devices) - set(found)):
+            print('Sensor {0} lost'.format(sensor))
+            self.poller.remove(sensor)
+            self.due.pop(sensor, None)
+
+    def start(self, now=None):
+        now = time.time() if now is None else now
+        for sensor in self.poller.sensors():
+            self.missed.setdefault(sensor, 0)
+            self.schedule(sensor, now)
+        self.next_discovery = now + self.rediscover
+
+    def step(self):
+        """ Sleep until the next deadline and poll everything due by then. """
+        now = time.time()
+        if now >= self.next_discovery:
+            self.discover(now)
+            self.next_discovery = now + self.rediscover
+        if not self.heap:
+            time.sleep(max(0, self.next_discovery - now))
+            return
+        due = self.heap[0][0]
+        if due > now:
+            time.sleep(min(due, self.next_discovery) - now)
+            return
+        batch = []
+        while self.heap and self.heap[0][0] <= now:
+            due, sensor = heapq.heappop(self.heap)
+            if self.due.get(sensor) == due:
+                batch.append((sensor, due))
+        temps = self.poller.poll([sensor for sensor, due in batch])
+        finished = time.time()
+        for sensor, due in batch:
+            if self.on_reading is not None:
+                self.on_reading(sensor, temps[sensor], due)
+            if self.adaptive is not None:
+                self.intervals[sensor] = self.adaptive.update(sensor, temps[sensor], due)
+            period = self.period(sensor)
+            due += period
+            if due <= finished:
+                skipped = int((finished - due) // period) + 1
+                due += skipped * period
+                self.missed[sensor] += skipped
+                if self.on_missed is not None:
+                    self.on_missed(sensor, skipped)
+            self.schedule(sensor, due)
+
+    def run(self):
+        self.start()
+        while not self.stopping:
+            self.step()
+
+    def stop(self):
+        self.stopping = True